@@ -15,6 +15,8 @@ from base.command.command_manager import Commander
 from base.command.command_runner import CommandRunner
 from base.config.config_manager import ConfigManager
 from base.database.ahenk_db_service import AhenkDbService
+from base.database.db_maintenance import DbMaintenance
+from base.database.schema_migration import SchemaMigration
 from base.deamon.base_daemon import BaseDaemon
 from base.event.event_manager import EventManager
 from base.execution.execution_manager import ExecutionManager
@@ -65,6 +67,7 @@ class AhenkDaemon(BaseDaemon):
         """ docstring"""
         scheduler_ins = SchedulerFactory.get_intstance()
         scheduler_ins.initialize()
+        scheduler_ins.add_job(DbMaintenance())
         Scope.get_instance().set_scheduler(scheduler_ins)
         sc_thread = threading.Thread(target=scheduler_ins.run)
         sc_thread.setDaemon(True)
@@ -85,6 +88,11 @@ class AhenkDaemon(BaseDaemon):
         db_service.connect()
         db_service.initialize_table()
         Scope.get_instance().set_sb_service(db_service)
+        SchemaMigration().migrate()
+
+        config = Scope.get_instance().get_configuration_manager()
+        if config.get('DATABASE', 'write_behind', fallback='true').strip().lower() == 'true':
+            db_service.start_writer(int(config.get('DATABASE', 'write_batch_size', fallback='100')))
         return db_service
 
     @staticmethod
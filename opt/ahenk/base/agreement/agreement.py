@@ -28,20 +28,18 @@ class Agreement:
             self.logger.debug('There is no any contract in database.')
             contract_id = '-1'
 
-        if self.db_service.select_one_result('agreement', 'id',
-                                             " contract_id='{0}' and username='{1}' and choice='Y' "
-                                                     .format(contract_id, username)) is not None:
+        if self.db_service.select_one_result('agreement', 'id', 'contract_id = ? and username = ? and choice = ?',
+                                             [str(contract_id), username, 'Y']) is not None:
             self.logger.debug('{0} answered agreement..')
             return True
-        elif self.db_service.select_one_result('agreement', 'id',
-                                               " contract_id='{0}' and username='{1}' and choice='N' ".format(
-                                                   contract_id, username)) is not None:
+        elif self.db_service.select_one_result('agreement', 'id', 'contract_id = ? and username = ? and choice = ?',
+                                               [str(contract_id), username, 'N']) is not None:
             return False
         else:
             return None
 
     def get_current_contract_id(self):
-        return self.db_service.select_one_result('contract', 'id', 'id =(select MAX(id) from contract)')
+        return self.db_service.select_one_result('contract', 'id', 'id =(select MAX(id) from contract)', cached=True)
 
     def ask(self, username, display):
 
@@ -72,11 +70,11 @@ class Agreement:
             if pout != 'Error':
                 if pout == 'Y':
                     self.logger.debug('Agreement was accepted by {0}.'.format(username))
-                    self.db_service.update('agreement', self.db_service.get_cols('agreement'),
-                                           [contract_id, username, Util.timestamp(), 'Y'])
+                    self.db_service.update_async('agreement', self.db_service.get_cols('agreement'),
+                                                 [contract_id, username, Util.timestamp(), 'Y'])
                 elif pout == 'N':
-                    self.db_service.update('agreement', self.db_service.get_cols('agreement'),
-                                           [contract_id, username, Util.timestamp(), 'N'])
+                    self.db_service.update_async('agreement', self.db_service.get_cols('agreement'),
+                                                 [contract_id, username, Util.timestamp(), 'N'])
                     self.logger.debug(
                         'Agreement was ignored by {0}. Session will be closed'.format(username))
                 else:
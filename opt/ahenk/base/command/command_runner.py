@@ -23,6 +23,7 @@ class CommandRunner(object):
         self.message_manager = scope.get_message_manager()
         self.messenger = scope.get_messenger()
         self.conf_manager = scope.get_configuration_manager()
+        self.mode_wait_timeout = int(self.conf_manager.get('PLUGIN', 'mode_wait_timeout', fallback='30'))
         self.db_service = scope.get_db_service()
         self.execute_manager = scope.get_execution_manager()
 
@@ -96,17 +97,18 @@ class CommandRunner(object):
                         agreement_choice = True
 
                     if agreement_choice is True:
-                        self.db_service.delete('session', 'username=\'{0}\''.format(username))
+                        self.db_service.delete_async('session', 'username = ?', [username])
 
                         self.logger.info(
                             'Display is {0}, desktop env is {1} for {2}'.format(display, desktop,
                                                                                 username))
                         session_columns = self.db_service.get_cols('session')
-                        self.db_service.update('session', session_columns,
-                                               [username, display, desktop, Util.timestamp()])
+                        self.db_service.update_async('session', session_columns,
+                                                     [username, display, desktop, Util.timestamp()])
                         get_policy_message = self.message_manager.policy_request_msg(username)
 
-                        self.plugin_manager.process_mode('safe', username)
+                        # login handlers run after safe mode cleaned previous session of user
+                        self.plugin_manager.process_mode('safe', username).wait(self.mode_wait_timeout)
                         self.plugin_manager.process_mode('login', username)
 
                         kward = dict()
@@ -125,14 +127,14 @@ class CommandRunner(object):
 
                 elif str(json_data['event']) == 'logout':
                     username = json_data['username']
-                    self.db_service.delete('session', 'username=\'{0}\''.format(username))
+                    self.db_service.delete_async('session', 'username = ?', [username])
                     self.execute_manager.remove_user_executed_policy_dict(username)
                     # TODO delete all user records while initializing
                     self.logger.info('logout event is handled for user: {0}'.format(username))
                     logout_message = self.message_manager.logout_msg(username)
                     self.messenger.send_direct_message(logout_message)
 
-                    self.plugin_manager.process_mode('logout', username)
+                    self.plugin_manager.process_mode('logout', username).wait(self.mode_wait_timeout)
                     self.plugin_manager.process_mode('safe', username)
 
                 elif str(json_data['event']) == 'send':
@@ -175,14 +177,20 @@ class CommandRunner(object):
                             self.plugin_manager.remove_single_plugin(p_name)
 
                 elif str(json_data['event']) == 'stop':
-                    self.plugin_manager.process_mode('shutdown')
+                    shutdown_timeout = int(self.conf_manager.get('PLUGIN', 'shutdown_timeout', fallback='90'))
+                    deadline = time.time() + shutdown_timeout
+                    self.plugin_manager.process_mode('shutdown').wait(shutdown_timeout)
                     self.logger.info('Shutdown mode activated.')
 
-                    # TODO timeout
                     while self.running_plugin() is False:
+                        if time.time() > deadline:
+                            self.logger.warning('Plugins did not stop in time, shutdown is continuing')
+                            break
                         self.logger.debug('Waiting for progress of plugins...')
                         time.sleep(0.5)
 
+                    self.plugin_manager.stop_process_pool()
+                    self.db_service.stop_writer(timeout=10)
                     Util.delete_file(System.Ahenk.fifo_file())
                     Scope().get_instance().get_custom_param('ahenk_daemon').stop()
                 else:
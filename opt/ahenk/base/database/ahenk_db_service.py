@@ -2,14 +2,27 @@
 # -*- coding: utf-8 -*-
 # Author: İsmail BAŞARAN <ismail.basaran@tubitak.gov.tr> <basaran.ismaill@gmail.com>
 # Author: Volkan Şahin <volkansah.in> <bm.volkansahin@gmail.com>
+import os
+import queue
 import sqlite3
 import threading
+from contextlib import contextmanager
+from base.database.db_writer import DbWriter
+from base.database.query_cache import QueryCache
 from base.scope import Scope
 
 
 class AhenkDbService(object):
     """
         Sqlite manager for ahenk
+        Every thread gets its own connection from the pool. Database runs in WAL journal mode, so readers
+        do not wait for each other or for the writer. Only write operations are serialized by lock.
+        Criteria values must be given as bound parameters, e.g.
+            db_service.select('session', ['display'], 'username = ?', criteria_args=[username])
+        so the same statement text is reused and compiled statements are served from cache.
+        Hot lookups may pass cached=True to be served from memory until a write touches their table.
+        Non-critical writes may go through update_async/delete_async/submit. They are committed in groups by
+        the writer thread; reading a table with queued writes waits for them, flush() waits for all of them.
     """
 
     def __init__(self):
@@ -17,10 +30,23 @@ class AhenkDbService(object):
         self.logger = scope.get_logger()
         self.configurationManager = scope.get_configuration_manager()
         self.db_path = self.configurationManager.get('BASE', 'dbPath')
-        self.connection = None
-        self.cursor = None
+        self.busy_timeout = 30
+        self.statement_cache_size = 256
+        self.statements = dict()
+        self.cache = QueryCache()
 
-        self.lock = threading.Lock()
+        self.lock = threading.RLock()
+        self.local = threading.local()
+        self.connections = []
+        self.connections_lock = threading.Lock()
+
+        self.writer = None
+        self.writer_pid = None
+        self.write_queue = queue.Queue()
+        self.write_condition = threading.Condition()
+        self.write_sequence = 0
+        self.written_sequence = 0
+        self.pending_tables = dict()
 
 
         # TODO get columns anywhere
@@ -69,20 +95,207 @@ class AhenkDbService(object):
         else:
             return None
 
-    def connect(self):
+    def get_connection(self):
+        # connections must not be shared across forked processes
+        if getattr(self.local, 'connection', None) is None or self.local.pid != os.getpid():
+            self.local.connection = self.create_connection()
+            self.local.pid = os.getpid()
+        return self.local.connection
+
+    def create_connection(self):
         try:
-            self.connection = sqlite3.connect(self.db_path, check_same_thread=False)
-            self.cursor = self.connection.cursor()
+            connection = sqlite3.connect(self.db_path, timeout=self.busy_timeout, check_same_thread=False,
+                                         cached_statements=self.statement_cache_size)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            with self.connections_lock:
+                self.release_dead_connections()
+                self.connections.append((os.getpid(), threading.current_thread(), connection))
+            return connection
         except Exception as e:
             self.logger.error('Database connection error: {0}'.format(str(e)))
+            return None
+
+    def release_dead_connections(self):
+        # short-lived threads (timers etc.) leave their connections behind,
+        # connections inherited from parent process are dropped without closing
+        alive = []
+        for pid, thread, connection in self.connections:
+            if pid != os.getpid():
+                continue
+            if thread.is_alive():
+                alive.append((pid, thread, connection))
+            else:
+                connection.close()
+        self.connections = alive
+
+    def connect(self):
+        self.get_connection()
+
+    def start_writer(self, batch_size=100):
+        if self.writer is None or not self.writer.is_alive():
+            self.writer = DbWriter(self, self.write_queue, batch_size)
+            self.writer.setDaemon(True)
+            self.writer.start()
+            self.writer_pid = os.getpid()
+            self.logger.debug('Database writer thread was started')
+
+    def stop_writer(self, timeout=None):
+        if self.is_writer_running():
+            self.flush(timeout)
+            self.write_queue.put(None)
+            self.writer.join(timeout)
+
+    def is_writer_running(self):
+        return self.writer is not None and self.writer_pid == os.getpid() and self.writer.is_alive() \
+               and threading.current_thread() is not self.writer
+
+    def submit(self, tables, function, *args, **kwargs):
+        """
+            Queues a write function to run on writer thread within a grouped transaction.
+            Runs it immediately when writer is not running in this process or caller is in a transaction.
+        """
+        if not self.is_writer_running() or self.in_transaction():
+            return function(*args, **kwargs)
+
+        with self.write_condition:
+            self.write_sequence += 1
+            for table in tables:
+                self.pending_tables[table] = self.pending_tables.get(table, 0) + 1
+            self.write_queue.put((self.write_sequence, tables, function, args, kwargs))
+
+    def update_async(self, table_name, cols, args, criteria=None, criteria_args=None):
+        self.submit([table_name], self.update, table_name, cols, args, criteria, criteria_args)
+
+    def delete_async(self, table_name, criteria=None, criteria_args=None):
+        self.submit([table_name], self.delete, table_name, criteria, criteria_args)
+
+    def write_done(self, operations):
+        with self.write_condition:
+            for sequence, tables, function, args, kwargs in operations:
+                self.written_sequence = max(self.written_sequence, sequence)
+                for table in tables:
+                    self.pending_tables[table] -= 1
+                    if self.pending_tables[table] <= 0:
+                        del self.pending_tables[table]
+            self.write_condition.notify_all()
+
+    def flush(self, timeout=None, tables=None):
+        """
+            Waits until queued writes are committed. If tables are given, only writes touching them are waited.
+            Returns False on timeout.
+        """
+        if not self.is_writer_running():
+            return True
+
+        with self.write_condition:
+            if tables is None:
+                sequence = self.write_sequence
+                return self.write_condition.wait_for(lambda: self.written_sequence >= sequence, timeout)
+            else:
+                return self.write_condition.wait_for(
+                    lambda: not any(table in self.pending_tables for table in tables), timeout)
+
+    def in_transaction(self):
+        return getattr(self.local, 'transaction_depth', 0) > 0
+
+    @contextmanager
+    def transaction(self):
+        """
+            Groups write operations of current thread into a single commit.
+            Usage:
+                with db_service.transaction():
+                    db_service.update(...)
+                    db_service.update_many(...)
+            Nested usage joins the outer transaction. Any exception rolls back all changes.
+        """
+        if not self.in_transaction():
+            # writer thread needs the lock too, queued writes are completed before taking it
+            self.flush()
+        self.lock.acquire(True)
+        self.local.transaction_depth = getattr(self.local, 'transaction_depth', 0) + 1
+        if self.local.transaction_depth == 1:
+            self.local.touched_tables = set()
+        try:
+            connection = self.get_connection()
+            if self.local.transaction_depth == 1 and not connection.in_transaction:
+                connection.execute('BEGIN')
+            yield self
+            if self.local.transaction_depth == 1:
+                self.get_connection().commit()
+        except Exception:
+            if self.local.transaction_depth == 1:
+                self.get_connection().rollback()
+            raise
+        finally:
+            self.local.transaction_depth -= 1
+            if self.local.transaction_depth == 0:
+                # other threads may have cached committed rows while transaction was open
+                for table in self.local.touched_tables:
+                    self.invalidate(table)
+            self.lock.release()
+
+    def commit(self, connection):
+        if not self.in_transaction():
+            connection.commit()
+
+    def invalidate(self, table_name=None):
+        if self.in_transaction():
+            self.local.touched_tables.add(table_name)
+        if table_name is None:
+            self.cache.invalidate_all()
+        else:
+            self.cache.invalidate(table_name)
+
+    def cache_stats(self):
+        return self.cache.stats()
+
+    def statement(self, key, build):
+        sql = self.statements.get(key)
+        if sql is None:
+            if len(self.statements) >= self.statement_cache_size:
+                self.logger.warning('Statement cache is full. Criteria values should be passed as bound parameters.')
+                self.statements = dict()
+            sql = build()
+            self.statements[key] = sql
+        return sql
+
+    @staticmethod
+    def build_insert(table_name, cols):
+        return 'INSERT INTO ' + table_name + ' (' + ', '.join([str(x) for x in cols]) + ') VALUES (' + ', '.join(
+            ['?' for x in cols]) + ')'
+
+    @staticmethod
+    def build_update(table_name, cols, criteria):
+        return 'UPDATE ' + table_name + ' SET ' + ', '.join([str(x) + ' = ?' for x in cols]) + ' where ' + criteria
+
+    @staticmethod
+    def build_delete(table_name, criteria):
+        sql = 'DELETE FROM ' + table_name
+        if criteria:
+            sql += ' where ' + str(criteria)
+        return sql
+
+    @staticmethod
+    def build_select(table_name, cols, criteria, orderby):
+        if not cols == '*':
+            cols = ', '.join([str(x) for x in cols])
+        sql = 'SELECT ' + cols + ' FROM ' + table_name
+        if criteria:
+            sql += ' where ' + criteria
+        if orderby:
+            sql += ' order by ' + orderby
+        return sql
 
     def check_and_create_table(self, table_name, cols):
 
         try:
             self.lock.acquire(True)
-            if self.cursor:
+            connection = self.get_connection()
+            if connection:
                 cols = ', '.join([str(x) for x in cols])
-                self.cursor.execute('create table if not exists ' + table_name + ' (' + cols + ')')
+                connection.execute('create table if not exists ' + table_name + ' (' + cols + ')')
+                self.commit(connection)
             else:
                 self.logger.warning('Could not create table cursor is None! Table Name : {0}'.format(str(table_name)))
         finally:
@@ -91,47 +304,132 @@ class AhenkDbService(object):
     def drop_table(self, table_name):
         try:
             self.lock.acquire(True)
+            connection = self.get_connection()
             sql = 'DROP TABLE ' + table_name
-            self.cursor.execute(sql)
-            self.connection.commit()
+            connection.execute(sql)
+            self.commit(connection)
+            self.invalidate(table_name)
+        finally:
+            self.lock.release()
+
+    def execute(self, sql, args=None):
+        try:
+            self.lock.acquire(True)
+            connection = self.get_connection()
+            if connection:
+                cursor = connection.execute(sql, tuple(args or ()))
+                self.commit(connection)
+                self.invalidate()
+                return cursor.rowcount
+            else:
+                self.logger.warning('Could not execute statement cursor is None! Statement : {0}'.format(str(sql)))
+                return None
+        finally:
+            self.lock.release()
+
+    def incremental_vacuum(self, pages):
+        """
+            Returns free pages of database to file system, at most given number of pages in one step.
+        """
+        try:
+            self.lock.acquire(True)
+            connection = self.get_connection()
+            # pragma frees one page per step, rows must be fetched to complete it
+            connection.execute('PRAGMA incremental_vacuum({0})'.format(int(pages))).fetchall()
+            return connection.execute('PRAGMA freelist_count').fetchone()[0]
         finally:
             self.lock.release()
 
-    def update(self, table_name, cols, args, criteria=None):
+    def auto_vacuum_mode(self):
+        """
+            Returns auto_vacuum mode of database, 0 is none, 1 is full and 2 is incremental.
+        """
+        return self.get_connection().execute('PRAGMA auto_vacuum').fetchone()[0]
+
+    def database_size(self):
+        connection = self.get_connection()
+        page_count = connection.execute('PRAGMA page_count').fetchone()[0]
+        page_size = connection.execute('PRAGMA page_size').fetchone()[0]
+        return page_count * page_size
+
+    def get_schema_version(self):
+        return self.get_connection().execute('PRAGMA user_version').fetchone()[0]
+
+    def set_schema_version(self, version):
+        self.execute('PRAGMA user_version = {0}'.format(int(version)))
+
+    def update(self, table_name, cols, args, criteria=None, criteria_args=None):
         try:
             self.lock.acquire(True)
-            if self.connection:
+            connection = self.get_connection()
+            if connection:
                 if criteria is None:
-                    cols = ', '.join([str(x) for x in cols])
-                    params = ', '.join(['?' for x in args])
-                    sql = 'INSERT INTO ' + table_name + ' (' + cols + ') VALUES (' + params + ')'
+                    sql = self.statement(('insert', table_name, tuple(cols)),
+                                         lambda: self.build_insert(table_name, cols))
+                    params = tuple(args)
                 else:
-                    update_list = ''
-                    for index in range(len(cols)):
-                        update_list = update_list + ' ' + cols[index] + ' = ?,'
-                    update_list = update_list.strip(',')
-                    sql = 'UPDATE ' + table_name + ' SET ' + update_list + ' where ' + criteria
-                self.cursor.execute(sql, tuple(args))
-                self.connection.commit()
-                return self.cursor.lastrowid
+                    sql = self.statement(('update', table_name, tuple(cols), criteria),
+                                         lambda: self.build_update(table_name, cols, criteria))
+                    params = tuple(args) + tuple(criteria_args or ())
+                cursor = connection.execute(sql, params)
+                self.commit(connection)
+                self.invalidate(table_name)
+                return cursor.lastrowid
             else:
                 self.logger.warning('Could not update table cursor is None! Table Name : {0}'.format(str(table_name)))
                 return None
         except Exception as e:
             self.logger.error(
                 'Updating table error ! Table Name : {0} Error Mesage: {1}'.format(str(table_name), str(e)))
+            if self.in_transaction():
+                raise
+        finally:
+            self.lock.release()
+
+    def update_many(self, table_name, cols, rows):
+        try:
+            self.lock.acquire(True)
+            connection = self.get_connection()
+            if connection:
+                sql = self.statement(('insert', table_name, tuple(cols)),
+                                     lambda: self.build_insert(table_name, cols))
+                cursor = connection.executemany(sql, [tuple(row) for row in rows])
+                self.commit(connection)
+                self.invalidate(table_name)
+                return cursor.rowcount
+            else:
+                self.logger.warning('Could not update table cursor is None! Table Name : {0}'.format(str(table_name)))
+                return None
+        except Exception as e:
+            self.logger.error(
+                'Bulk inserting error ! Table Name : {0} Error Mesage: {1}'.format(str(table_name), str(e)))
+            if self.in_transaction():
+                raise
         finally:
             self.lock.release()
 
-    def delete(self, table_name, criteria):
+    def upsert(self, table_name, cols, args, key_cols):
+        """
+            Updates the row matching key columns or inserts a new one. Returns id of the row.
+        """
+        with self.transaction():
+            criteria = ' and '.join([str(x) + ' = ?' for x in key_cols])
+            key_args = [args[cols.index(x)] for x in key_cols]
+            row_id = self.select_one_result(table_name, 'id', criteria, key_args)
+            if row_id is None:
+                return self.update(table_name, cols, args)
+            self.update(table_name, cols, args, 'id = ?', [row_id])
+            return row_id
+
+    def delete(self, table_name, criteria=None, criteria_args=None):
         try:
             self.lock.acquire(True)
-            if self.cursor:
-                sql = 'DELETE FROM ' + table_name
-                if criteria:
-                    sql += ' where ' + str(criteria)
-                self.cursor.execute(sql)
-                self.connection.commit()
+            connection = self.get_connection()
+            if connection:
+                sql = self.statement(('delete', table_name, criteria), lambda: self.build_delete(table_name, criteria))
+                connection.execute(sql, tuple(criteria_args or ()))
+                self.commit(connection)
+                self.invalidate(table_name)
         finally:
             self.lock.release()
 
@@ -139,54 +437,63 @@ class AhenkDbService(object):
         # Not implemented yet
         pass
 
-    def select(self, table_name, cols='*', criteria='', orderby=''):
-        if self.cursor:
-            try:
-                self.lock.acquire(True)
-                if not cols == '*':
-                    cols = ', '.join([str(x) for x in cols])
-                sql = 'SELECT ' + cols + ' FROM ' + table_name
-                if criteria != '':
-                    sql += ' where '
-                    sql += criteria
-                if orderby != '':
-                    sql += ' order by '
-                    sql += orderby
-
-                self.cursor.execute(sql)
-                rows = self.cursor.fetchall()
-                return rows
-            except:
-                raise
-            finally:
-                self.lock.release()
+    def select(self, table_name, cols='*', criteria='', orderby='', criteria_args=None, cached=False):
+        sql = self.statement(('select', table_name, tuple(cols), criteria, orderby),
+                             lambda: self.build_select(table_name, cols, criteria, orderby))
+        return self.fetch([table_name], sql, criteria_args, cached)
+
+    def select_one_result(self, table_name, col, criteria='', criteria_args=None, cached=False):
+        sql = self.statement(('select', table_name, (col,), criteria, ''),
+                             lambda: self.build_select(table_name, [col], criteria, ''))
+        row = self.fetch([table_name], sql, criteria_args, cached, one=True)
+        if row is not None:
+            return row[0]
         else:
-            self.logger.warning('Could not select table cursor is None! Table Name : {0}'.format(str(table_name)))
+            return None
 
-    def select_one_result(self, table_name, col, criteria=''):
-        if self.cursor:
+    def fetch(self, tables, sql, args=None, cached=False, one=False):
+        params = tuple(args or ())
+        if self.pending_tables and not self.in_transaction() and any(
+                table in self.pending_tables for table in tables):
+            self.flush(tables=tables)
+
+        # uncommitted rows of a transaction must not leak into cache
+        cached = cached and not self.in_transaction()
+        if cached:
+            key = (sql, params, one)
+            found, result = self.cache.get(key)
+            if found:
+                return list(result) if not one else result
+            generation = self.cache.generation(tables)
+
+        connection = self.get_connection()
+        if connection:
+            cursor = connection.cursor()
             try:
-                self.lock.acquire(True)
-                sql = 'SELECT ' + col + ' FROM ' + table_name
-                if criteria != '':
-                    sql += ' where '
-                    sql += criteria
-                self.cursor.execute(sql)
-                row = self.cursor.fetchone()
-                if row is not None:
-                    return row[0]
+                cursor.execute(sql, params)
+                if one:
+                    result = cursor.fetchone()
                 else:
-                    return None
+                    result = cursor.fetchall()
             except:
                 raise
             finally:
-                self.lock.release()
+                cursor.close()
         else:
-            self.logger.warning('Could not select table cursor is None! Table Name : {0}'.format(str(table_name)))
+            self.logger.warning('Could not select table cursor is None! Table Name : {0}'.format(str(tables)))
+            return None
+
+        if cached:
+            self.cache.put(key, tables, tuple(result) if not one else result, generation)
+        return result
 
     def close(self):
         try:
-            self.cursor.close()
-            self.connection.close()
+            with self.connections_lock:
+                for pid, thread, connection in self.connections:
+                    if pid == os.getpid():
+                        connection.close()
+                self.connections = []
+            self.local = threading.local()
         except Exception as e:
             self.logger.error('Closing database connection error: {0}'.format(str(e)))
@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+from base.scope import Scope
+
+
+class DbMaintenance(object):
+    """
+        Scheduled retention and compaction job for ahenk database.
+        Keeps configured number of newest rows of task, agreement and contract tables and deletes the rest
+        in small batches, then returns freed pages to file system with incremental vacuum.
+        Scheduled tasks, the latest answers of current contract and the current contract are never pruned.
+    """
+
+    def __init__(self):
+        scope = Scope.get_instance()
+        self.logger = scope.get_logger()
+        self.db_service = scope.get_db_service()
+        config = scope.get_configuration_manager()
+
+        maintenance_time = config.get('DATABASE', 'maintenance_time', fallback='03:30').split(':')
+        self.hour = int(maintenance_time[0])
+        self.minute = int(maintenance_time[1])
+        self.batch_size = int(config.get('DATABASE', 'prune_batch_size', fallback='100'))
+        self.vacuum_pages = int(config.get('DATABASE', 'vacuum_pages', fallback='100'))
+        self.retention = dict()
+        for table_name, default in (('task', '1000'), ('agreement', '1000'), ('contract', '10')):
+            self.retention[table_name] = int(
+                config.get('DATABASE', '{0}_retention'.format(table_name), fallback=default))
+
+        # rows of these conditions are kept regardless of retention
+        self.protected = {
+            'task': 'CAST(id AS TEXT) IN (SELECT task_id FROM schedule_task)',
+            'agreement': 'contract_id = CAST((SELECT MAX(id) FROM contract) AS TEXT) AND id IN '
+                         '(SELECT MAX(id) FROM agreement GROUP BY contract_id, username)',
+            'contract': 'id = (SELECT MAX(id) FROM contract)'
+        }
+
+    def check(self, t):
+        if t.hour == self.hour and t.minute == self.minute:
+            self.run()
+
+    def run(self):
+        try:
+            self.logger.info('Database maintenance is running...')
+            size_before = self.db_service.database_size()
+
+            for table_name, keep in self.retention.items():
+                if keep > 0:
+                    deleted = self.prune(table_name, keep)
+                    self.logger.debug('{0} old rows were deleted from {1} table'.format(deleted, table_name))
+            self.db_service.execute(
+                'DELETE FROM plugin WHERE CAST(id AS TEXT) NOT IN (SELECT plugin FROM task WHERE plugin IS NOT NULL) '
+                'AND CAST(id AS TEXT) NOT IN (SELECT plugin FROM profile WHERE plugin IS NOT NULL)')
+
+            self.vacuum()
+
+            self.logger.info('Database maintenance is completed. Database size: {0} bytes before, {1} bytes after'
+                             .format(size_before, self.db_service.database_size()))
+        except Exception as e:
+            self.logger.error('A problem occurred while database maintenance. Error Message: {0}'.format(str(e)))
+
+    def vacuum(self):
+        # incremental vacuum does nothing unless database is in incremental auto_vacuum mode
+        if self.db_service.auto_vacuum_mode() != 2:
+            self.logger.warning('Database is not in incremental auto vacuum mode, free pages are not released')
+            return
+        free_pages = None
+        while True:
+            remaining = self.db_service.incremental_vacuum(self.vacuum_pages)
+            if remaining == 0 or (free_pages is not None and remaining >= free_pages):
+                break
+            free_pages = remaining
+
+    def prune(self, table_name, keep):
+        sql = 'DELETE FROM ' + table_name + ' WHERE rowid IN (SELECT rowid FROM ' + table_name + \
+              ' WHERE rowid <= (SELECT rowid FROM ' + table_name + ' ORDER BY rowid DESC LIMIT 1 OFFSET ?)' + \
+              ' AND NOT (' + self.protected[table_name] + ') LIMIT ?)'
+        total = 0
+        while True:
+            deleted = self.db_service.execute(sql, [keep, self.batch_size])
+            if not deleted:
+                break
+            total += deleted
+        return total
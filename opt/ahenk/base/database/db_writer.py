@@ -0,0 +1,55 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import threading
+
+from base.scope import Scope
+
+
+class DbWriter(threading.Thread):
+    """
+        Write-behind thread of AhenkDbService.
+        Drains queued write operations and commits them in groups. If a group fails, its operations
+        are retried one by one so a single bad write does not drop the others.
+    """
+
+    def __init__(self, db_service, write_queue, batch_size=100):
+        super(DbWriter, self).__init__()
+        self.logger = Scope.get_instance().get_logger()
+        self.db_service = db_service
+        self.write_queue = write_queue
+        self.batch_size = batch_size
+
+    def run(self):
+        keep_run = True
+        while keep_run:
+            batch = [self.write_queue.get(block=True)]
+            while len(batch) < self.batch_size and not self.write_queue.empty():
+                batch.append(self.write_queue.get(block=False))
+
+            if None in batch:
+                keep_run = False
+                batch = [operation for operation in batch if operation is not None]
+
+            try:
+                with self.db_service.transaction():
+                    for operation in batch:
+                        self.apply(operation)
+            except Exception as e:
+                self.logger.warning(
+                    'Grouped database write failed, operations are retried one by one. Error Message: {0}'.format(
+                        str(e)))
+                for operation in batch:
+                    try:
+                        with self.db_service.transaction():
+                            self.apply(operation)
+                    except Exception as e:
+                        self.logger.error(
+                            'Queued database write was dropped. Tables: {0} Error Message: {1}'.format(
+                                str(operation[1]), str(e)))
+            finally:
+                self.db_service.write_done(batch)
+
+    def apply(self, operation):
+        sequence, tables, function, args, kwargs = operation
+        function(*args, **kwargs)
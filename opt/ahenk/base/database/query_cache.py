@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import threading
+
+
+class QueryCache(object):
+    """
+        Read-through cache for small, frequently read query results of AhenkDbService.
+        Entries are grouped by the tables they read, any write on a table drops its entries.
+        Each table has a generation number, so a result read before a write is not stored after it.
+    """
+
+    def __init__(self, max_size=512):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = dict()
+        self.table_keys = dict()
+        self.generations = dict()
+        self.epoch = 0
+        self.hits = 0
+        self.misses = 0
+
+    def generation(self, tables):
+        with self.lock:
+            return self.current_generation(tables)
+
+    def current_generation(self, tables):
+        return (self.epoch,) + tuple(self.generations.get(table, 0) for table in tables)
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                return True, self.entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, tables, value, generation):
+        with self.lock:
+            if generation != self.current_generation(tables):
+                return
+            if len(self.entries) >= self.max_size:
+                self.remove(next(iter(self.entries)))
+            self.entries[key] = value
+            for table in tables:
+                self.table_keys.setdefault(table, set()).add(key)
+
+    def remove(self, key):
+        del self.entries[key]
+        for keys in self.table_keys.values():
+            keys.discard(key)
+
+    def invalidate(self, table):
+        with self.lock:
+            self.generations[table] = self.generations.get(table, 0) + 1
+            for key in self.table_keys.pop(table, set()):
+                if key in self.entries:
+                    self.remove(key)
+
+    def invalidate_all(self):
+        with self.lock:
+            self.epoch += 1
+            self.entries = dict()
+            self.table_keys = dict()
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses,
+                    'hit_ratio': float(self.hits) / total if total > 0 else 0.0}
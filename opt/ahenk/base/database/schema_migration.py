@@ -0,0 +1,101 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+from base.scope import Scope
+
+
+class SchemaMigration(object):
+    """
+        Brings ahenk database schema up to date.
+        Schema version is kept in sqlite user_version pragma. Migrations are applied in order at startup,
+        each one in its own transaction together with the version bump. Migrations which can not run in a
+        transaction (e.g. VACUUM) are marked as non-transactional. Compaction is best effort, its failure does not
+        stop schema changing migrations.
+    """
+
+    def __init__(self):
+        scope = Scope.get_instance()
+        self.logger = scope.get_logger()
+        self.db_service = scope.get_db_service()
+
+        self.migrations = [
+            (1, 'Indexes on policy, profile, plugin, agreement, session, task and schedule task lookups',
+             self.add_lookup_indexes),
+            (2, 'Unique plugin rows per name and version', self.compact_plugins),
+            (3, 'Incremental auto vacuum', self.enable_incremental_vacuum, False),
+            (4, 'Profile result history', self.add_profile_result),
+            (5, 'Task result', self.add_task_result)
+        ]
+
+    def migrate(self):
+        version = self.db_service.get_schema_version()
+        self.logger.debug('Database schema version is {0}'.format(version))
+
+        for item in self.migrations:
+            number, description, migration = item[:3]
+            transactional = item[3] if len(item) > 3 else True
+            if number <= version:
+                continue
+            try:
+                self.logger.info('Applying database migration {0}: {1}'.format(number, description))
+                if transactional:
+                    with self.db_service.transaction():
+                        migration()
+                        self.db_service.set_schema_version(number)
+                else:
+                    migration()
+                    self.db_service.set_schema_version(number)
+                version = number
+            except Exception as e:
+                self.logger.error(
+                    'Database migration {0} could not be applied. Schema stays at version {1}. Error Message: {2}'.format(
+                        number, version, str(e)))
+                break
+        return version
+
+    def add_lookup_indexes(self):
+        self.db_service.execute('CREATE INDEX IF NOT EXISTS policy_type_name ON policy (type, name)')
+        self.db_service.execute('CREATE INDEX IF NOT EXISTS profile_id ON profile (id)')
+        self.db_service.execute('CREATE INDEX IF NOT EXISTS plugin_name_version ON plugin (name, version)')
+        self.db_service.execute('CREATE INDEX IF NOT EXISTS task_id ON task (id)')
+        self.db_service.execute(
+            'CREATE INDEX IF NOT EXISTS agreement_contract_username_choice ON agreement (contract_id, username, choice)')
+
+        # only the latest session of a user is meaningful
+        self.db_service.execute(
+            'DELETE FROM session WHERE rowid NOT IN (SELECT MAX(rowid) FROM session GROUP BY username)')
+        self.db_service.execute('CREATE UNIQUE INDEX IF NOT EXISTS session_username ON session (username)')
+
+        self.db_service.execute(
+            'CREATE TABLE IF NOT EXISTS schedule_task (id INTEGER PRIMARY KEY AUTOINCREMENT, task_id TEXT)')
+        self.db_service.execute('CREATE INDEX IF NOT EXISTS schedule_task_task_id ON schedule_task (task_id)')
+
+    def compact_plugins(self):
+        # point task and profile references to the first row of each (name, version)
+        for table_name in ('task', 'profile'):
+            self.db_service.execute(
+                'UPDATE ' + table_name + ' SET plugin = (SELECT MIN(keep.id) FROM plugin AS dup JOIN plugin AS keep '
+                'ON keep.name IS dup.name AND keep.version IS dup.version WHERE dup.id = ' + table_name + '.plugin) '
+                'WHERE EXISTS (SELECT 1 FROM plugin WHERE plugin.id = ' + table_name + '.plugin)')
+        self.db_service.execute('DELETE FROM plugin WHERE id NOT IN (SELECT MIN(id) FROM plugin GROUP BY name, version)')
+        self.db_service.execute('DROP INDEX IF EXISTS plugin_name_version')
+        self.db_service.execute('CREATE UNIQUE INDEX plugin_name_version ON plugin (name, version)')
+
+    def enable_incremental_vacuum(self):
+        # auto_vacuum mode of an existing database changes only after a full vacuum
+        self.db_service.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        try:
+            self.db_service.execute('VACUUM')
+        except Exception as e:
+            self.logger.warning('Database could not be vacuumed, auto vacuum mode stays unchanged. '
+                                'Error Message: {0}'.format(str(e)))
+
+    def add_profile_result(self):
+        self.db_service.execute(
+            'CREATE TABLE IF NOT EXISTS profile_result (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT, '
+            'plugin TEXT, profile_hash TEXT, response_code TEXT)')
+        self.db_service.execute(
+            'CREATE UNIQUE INDEX IF NOT EXISTS profile_result_username_plugin ON profile_result (username, plugin)')
+
+    def add_task_result(self):
+        self.db_service.execute('ALTER TABLE task ADD COLUMN result TEXT')
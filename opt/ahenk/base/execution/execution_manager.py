@@ -4,7 +4,11 @@
 
 import json
 
+from base.execution.policy_cache import PolicyCache
+from base.execution.script_pool import ScriptPool
 from base.file.file_transfer_manager import FileTransferManager
+from base.file.package_cache import PackageCache
+from base.model.bean_decoder import BeanDecoder
 from base.model.enum.content_type import ContentType
 from base.model.enum.message_code import MessageCode
 from base.model.enum.message_type import MessageType
@@ -30,12 +34,17 @@ class ExecutionManager(object):
         self.config_manager = scope.get_configuration_manager()
         self.event_manager = scope.get_event_manager()
         self.task_manager = scope.get_task_manager()
-        self.messenger = scope.get_messenger()
         self.logger = scope.get_logger()
         self.db_service = scope.get_db_service()
         self.message_manager = scope.get_message_manager()
         self.plugin_manager = scope.get_plugin_manager()
         self.policy_executed = dict()
+        self.policy_cache = PolicyCache()
+        self.package_cache = PackageCache()
+        self.script_timeout = int(self.config_manager.get('SCRIPT', 'timeout', fallback='600'))
+        self.script_pool = ScriptPool(self.run_script,
+                                      int(self.config_manager.get('SCRIPT', 'workers', fallback='2')),
+                                      int(self.config_manager.get('SCRIPT', 'queue_size', fallback='10')))
 
         self.event_manager.register_event(MessageType.EXECUTE_SCRIPT.value, self.execute_script)
         self.event_manager.register_event(MessageType.EXECUTE_TASK.value, self.execute_task)
@@ -47,7 +56,7 @@ class ExecutionManager(object):
     def agreement_update(self, arg):
 
         try:
-            json_data = json.loads(arg)
+            json_data = arg
             transfer_manager = FileTransferManager(json_data['protocol'], json_data['parameterMap'])
 
             transfer_manager.transporter.connect()
@@ -70,24 +79,30 @@ class ExecutionManager(object):
                 'A problem occurred while updating agreement. Error Message : {0}'.format(str(e)))
 
     def install_plugin(self, arg):
-        plugin = json.loads(arg)
+        plugin = arg
         self.logger.debug('Installing missing plugin')
         try:
             plugin_name = plugin['pluginName']
             plugin_version = plugin['pluginVersion']
 
-            try:
-                transfer_manager = FileTransferManager(plugin['protocol'], plugin['parameterMap'])
-                transfer_manager.transporter.connect()
-                file_name = transfer_manager.transporter.get_file()
-                transfer_manager.transporter.disconnect()
-                downloaded_file = System.Ahenk.received_dir_path() + file_name
-            except Exception as e:
-                self.logger.error(
-                    'Plugin package could not fetch. Error Message: {0}.'.format(str(e)))
-                self.logger.error('Plugin Installation is cancelling')
-                self.plugin_installation_failure(plugin_name, plugin_version)
-                return
+            downloaded_file = self.package_cache.get(plugin_name, plugin_version, plugin.get('md5'))
+            if downloaded_file is not None:
+                self.logger.debug('Plugin package was found in package cache: {0}'.format(downloaded_file))
+            else:
+                try:
+                    transfer_manager = FileTransferManager(plugin['protocol'], plugin['parameterMap'])
+                    transfer_manager.transporter.connect()
+                    file_name = transfer_manager.transporter.get_file()
+                    transfer_manager.transporter.disconnect()
+                    downloaded_file = self.package_cache.put(plugin_name, plugin_version,
+                                                             System.Ahenk.received_dir_path() + file_name,
+                                                             plugin.get('md5'))
+                except Exception as e:
+                    self.logger.error(
+                        'Plugin package could not fetch. Error Message: {0}.'.format(str(e)))
+                    self.logger.error('Plugin Installation is cancelling')
+                    self.plugin_installation_failure(plugin_name, plugin_version)
+                    return
 
             try:
                 Util.install_with_gdebi(downloaded_file)
@@ -97,11 +112,12 @@ class ExecutionManager(object):
                 self.plugin_installation_failure(plugin_name, plugin_version)
                 return
 
-            try:
-                Util.delete_file(downloaded_file)
-                self.logger.debug('Temp files were removed.')
-            except Exception as e:
-                self.logger.error('Could not remove temp file. Error Message: {0}'.format(str(e)))
+            if not self.package_cache.is_enabled():
+                try:
+                    Util.delete_file(downloaded_file)
+                    self.logger.debug('Temp files were removed.')
+                except Exception as e:
+                    self.logger.error('Could not remove temp file. Error Message: {0}'.format(str(e)))
 
         except Exception as e:
             self.logger.error(
@@ -115,8 +131,8 @@ class ExecutionManager(object):
         if plugin_name in self.plugin_manager.delayed_profiles.keys():
             profile = self.plugin_manager.delayed_profiles[plugin_name]
             self.logger.warning('An error message sending with related profile properties...')
-            related_policy = self.db_service.select('policy', ['version', 'execution_id'],
-                                                    'id={0}'.format(profile.get_id()))
+            related_policy = self.db_service.select('policy', ['version', 'execution_id'], 'id = ?',
+                                                    criteria_args=[profile.get_id()])
             data = dict()
             data['message'] = "Profil işletilirken eklenti bulunamadı "
             "ve eksik olan eklenti kurulmaya çalışırken hata ile karşılaşıldı. "
@@ -154,8 +170,10 @@ class ExecutionManager(object):
                                 message="Görev işletilirken eklenti bulunamadı "
                                         "ve eksik olan eklenti kurulmaya çalışırken oluştu.",
                                 data=json.dumps(data), content_type=ContentType.APPLICATION_JSON.value)
+            message = self.message_manager.task_status_msg(response)
+            self.task_manager.release_task(task.get_id())
             messenger = Scope.get_instance().get_messenger()
-            messenger.send_direct_message(self.message_manager.task_status_msg(response))
+            messenger.send_direct_message(message)
             self.logger.warning(
                 'Error message was sent about {0} plugin installation failure while trying to run a task')
 
@@ -174,7 +192,7 @@ class ExecutionManager(object):
 
     def update_scheduled_task(self, arg):
         self.logger.debug('Working on scheduled task ...')
-        update_scheduled_json = json.loads(arg)
+        update_scheduled_json = arg
         scheduler = Scope.get_instance().get_scheduler()
 
         if str(update_scheduled_json['cronExpression']).lower() == 'none' or update_scheduled_json[
@@ -182,13 +200,12 @@ class ExecutionManager(object):
             self.logger.debug('Scheduled task will be removed')
             scheduler.remove_job(int(update_scheduled_json['taskId']))
             self.logger.debug('Task removed from scheduled database')
-            self.db_service.update('task', ['deleted'], ['True'],
-                                   'id={0}'.format(update_scheduled_json['taskId']))
+            self.db_service.update('task', ['deleted'], ['True'], 'id = ?', [update_scheduled_json['taskId']])
             self.logger.debug('Task table updated.')
         else:
             self.logger.debug('Scheduled task cron expression will be updated.')
-            self.db_service.update('task', ['cron_expr'], [str(update_scheduled_json['cronExpression'])],
-                                   'id={0}'.format(update_scheduled_json['taskId']))
+            self.db_service.update('task', ['cron_expr'], [str(update_scheduled_json['cronExpression'])], 'id = ?',
+                                   [update_scheduled_json['taskId']])
             self.logger.debug('Task table updated.')
             scheduler.remove_job(str(update_scheduled_json['taskId']))
             self.logger.debug('Previous scheduled task removed.')
@@ -197,14 +214,16 @@ class ExecutionManager(object):
 
     def get_task_bean_by_id(self, task_id):
 
-        task_row = self.db_service.select('task', self.db_service.get_cols('task'), 'id={0}'.format(task_id))[0]
+        task_row = self.db_service.select('task', self.db_service.get_cols('task'), 'id = ?',
+                                          criteria_args=[task_id])[0]
         task = TaskBean(task_row[0], task_row[1], task_row[2], task_row[3], task_row[4], task_row[5],
                         self.get_plugin_bean_by_id(task_row[6]),
                         task_row[7], task_row[8])
         return task
 
     def get_plugin_bean_by_id(self, plugin_id):
-        plugin_row = self.db_service.select('plugin', self.db_service.get_cols('plugin'), 'id={0}'.format(plugin_id))[0]
+        plugin_row = self.db_service.select('plugin', self.db_service.get_cols('plugin'), 'id = ?',
+                                            criteria_args=[plugin_id])[0]
         plugin = PluginBean(plugin_row[0], plugin_row[1], plugin_row[2], plugin_row[3], plugin_row[4], plugin_row[5],
                             plugin_row[6], plugin_row[7], plugin_row[8], plugin_row[11], plugin_row[9], plugin_row[10],
                             plugin_row[12])
@@ -212,172 +231,204 @@ class ExecutionManager(object):
 
     def execute_policy(self, arg):
         self.logger.debug('Updating policies...')
-        policy = self.json_to_PolicyBean(json.loads(arg))
+        policy = BeanDecoder.policy_message(arg)
         self.policy_executed[policy.get_username()] = True
-        machine_uid = self.db_service.select_one_result('registration', 'jid', 'registered=1')
-        ahenk_policy_ver = self.db_service.select_one_result('policy', 'version', 'type = \'A\'')
-        user_policy_version = self.db_service.select_one_result('policy', 'version',
-                                                                'type = \'U\' and name = \'' + policy.get_username() + '\'')
 
-        profile_columns = ['id', 'create_date', 'modify_date', 'label', 'description', 'overridable', 'active',
-                           'deleted', 'profile_data', 'plugin']
-        plugin_columns = ['active', 'create_date', 'deleted', 'description', 'machine_oriented', 'modify_date', 'name',
-                          'policy_plugin', 'user_oriented', 'version', 'task_plugin', 'x_based']
+        agent_changed, user_changed = False, False
+        try:
+            with self.db_service.transaction():
+                agent_changed, user_changed = self.save_policy(policy)
+        except Exception as e:
+            self.logger.error('A problem occurred while saving policy. Error Message: {0}'.format(str(e)))
+
+        # cache is invalidated after commit, a reader between them would cache old rows under new generation
+        if agent_changed:
+            self.policy_cache.invalidate()
+        elif user_changed:
+            self.policy_cache.invalidate(policy.get_username())
+
+        policy = self.get_active_policies(policy.get_username())
+        self.task_manager.addPolicy(policy)
 
-        if policy.get_ahenk_policy_version() != ahenk_policy_ver:
-            ahenk_policy_id = self.db_service.select_one_result('policy', 'id', 'type = \'A\'')
+    def save_policy(self, policy):
+        """
+            Saves agent and user policies, returns whether agent policy and user policy were changed.
+        """
+        machine_uid = self.db_service.select_one_result('registration', 'jid', 'registered = ?', [1])
+        ahenk_policy_ver = self.db_service.select_one_result('policy', 'version', 'type = ?', ['A'])
+        user_policy_version = self.db_service.select_one_result('policy', 'version', 'type = ? and name = ?',
+                                                                ['U', policy.get_username()])
+
+        agent_changed = policy.get_ahenk_policy_version() != ahenk_policy_ver
+        user_changed = policy.get_user_policy_version() != user_policy_version
+
+        if agent_changed:
+            ahenk_policy_id = self.db_service.select_one_result('policy', 'id', 'type = ?', ['A'])
             if ahenk_policy_id is not None:
-                self.db_service.delete('profile', 'id=' + str(ahenk_policy_id))
-                self.db_service.delete('plugin', 'id=' + str(ahenk_policy_id))
-                self.db_service.update('policy', ['version'], [str(policy.get_ahenk_policy_version())], 'type=\'A\'')
+                self.db_service.delete('profile', 'id = ?', [ahenk_policy_id])
+                self.db_service.update('policy', ['version'], [str(policy.get_ahenk_policy_version())], 'type = ?',
+                                       ['A'])
             else:
                 self.db_service.update('policy', ['type', 'version', 'name', 'execution_id'],
                                        ['A', str(policy.get_ahenk_policy_version()), machine_uid,
                                         policy.get_agent_execution_id()])
-                ahenk_policy_id = self.db_service.select_one_result('policy', 'id', 'type = \'A\'')
-
-            for profile in policy.get_ahenk_profiles():
-                plugin = profile.get_plugin()
+                ahenk_policy_id = self.db_service.select_one_result('policy', 'id', 'type = ?', ['A'])
 
-                plugin_args = [str(plugin.get_active()), str(plugin.get_create_date()), str(plugin.get_deleted()),
-                               str(plugin.get_description()), str(plugin.get_machine_oriented()),
-                               str(plugin.get_modify_date()), str(plugin.get_name()), str(plugin.get_policy_plugin()),
-                               str(plugin.get_user_oriented()), str(plugin.get_version()),
-                               str(plugin.get_task_plugin()), str(plugin.get_x_based())]
-                plugin_id = self.db_service.update('plugin', plugin_columns, plugin_args)
-
-                profile_args = [str(ahenk_policy_id), str(profile.get_create_date()), str(profile.get_modify_date()),
-                                str(profile.get_label()), str(profile.get_description()),
-                                str(profile.get_overridable()), str(profile.get_active()), str(profile.get_deleted()),
-                                str(profile.get_profile_data()), plugin_id]
-                self.db_service.update('profile', profile_columns, profile_args)
+            self.save_profiles(ahenk_policy_id, policy.get_ahenk_profiles())
 
         else:
             self.logger.debug('Already there is ahenk policy. Command Execution Id is updating')
-            self.db_service.update('policy', ['execution_id'], [policy.get_agent_execution_id()], 'type = \'A\'')
+            self.db_service.update('policy', ['execution_id'], [policy.get_agent_execution_id()], 'type = ?', ['A'])
 
-        if policy.get_user_policy_version() != user_policy_version:
-            user_policy_id = self.db_service.select_one_result('policy', 'id',
-                                                               'type = \'U\' and name=\'' + policy.get_username() + '\'')
+        if user_changed:
+            user_policy_id = self.db_service.select_one_result('policy', 'id', 'type = ? and name = ?',
+                                                               ['U', policy.get_username()])
             if user_policy_id is not None:
-                # TODO remove profiles' plugins
-                self.db_service.delete('profile', 'id=' + str(user_policy_id))
-                self.db_service.delete('plugin', 'id=' + str(user_policy_id))
+                self.db_service.delete('profile', 'id = ?', [user_policy_id])
                 self.db_service.update('policy', ['version'], [str(policy.get_user_policy_version())],
-                                       'type=\'U\' and name=\'' + policy.get_username() + '\'')
+                                       'type = ? and name = ?', ['U', policy.get_username()])
             else:
                 self.db_service.update('policy', ['type', 'version', 'name', 'execution_id'],
                                        ['U', str(policy.get_user_policy_version()), policy.get_username(),
                                         policy.get_user_execution_id()])
-                user_policy_id = self.db_service.select_one_result('policy', 'id',
-                                                                   'type = \'U\' and name=\'' + policy.get_username() + '\'')
-
-            for profile in policy.get_user_profiles():
-                plugin = profile.get_plugin()
-
-                plugin_args = [str(plugin.get_active()), str(plugin.get_create_date()), str(plugin.get_deleted()),
-                               str(plugin.get_description()), str(plugin.get_machine_oriented()),
-                               str(plugin.get_modify_date()), str(plugin.get_name()), str(plugin.get_policy_plugin()),
-                               str(plugin.get_user_oriented()), str(plugin.get_version()),
-                               str(plugin.get_task_plugin()), str(plugin.get_x_based())]
-                plugin_id = self.db_service.update('plugin', plugin_columns, plugin_args)
+                user_policy_id = self.db_service.select_one_result('policy', 'id', 'type = ? and name = ?',
+                                                                   ['U', policy.get_username()])
 
-                profile_args = [str(user_policy_id), str(profile.get_create_date()), str(profile.get_modify_date()),
-                                str(profile.get_label()), str(profile.get_description()),
-                                str(profile.get_overridable()), str(profile.get_active()), str(profile.get_deleted()),
-                                str(profile.get_profile_data()), plugin_id]
-                self.db_service.update('profile', profile_columns, profile_args)
+            self.save_profiles(user_policy_id, policy.get_user_profiles())
 
         else:
             self.logger.debug('Already there is user policy. . Command Execution Id is updating')
-            self.db_service.update('policy', ['execution_id'], [policy.get_user_execution_id()], 'type = \'U\'')
+            self.db_service.update('policy', ['execution_id'], [policy.get_user_execution_id()],
+                                   'type = ? and name = ?', ['U', policy.get_username()])
 
-        policy = self.get_active_policies(policy.get_username())
-        self.task_manager.addPolicy(policy)
+        return agent_changed, user_changed
+
+    def save_profiles(self, policy_id, profiles):
+        profile_columns = ['id', 'create_date', 'modify_date', 'label', 'description', 'overridable', 'active',
+                           'deleted', 'profile_data', 'plugin']
+        plugin_columns = ['active', 'create_date', 'deleted', 'description', 'machine_oriented', 'modify_date', 'name',
+                          'policy_plugin', 'user_oriented', 'version', 'task_plugin', 'x_based']
+
+        profile_rows = []
+        for profile in profiles:
+            plugin = profile.get_plugin()
+
+            plugin_args = [str(plugin.get_active()), str(plugin.get_create_date()), str(plugin.get_deleted()),
+                           str(plugin.get_description()), str(plugin.get_machine_oriented()),
+                           str(plugin.get_modify_date()), str(plugin.get_name()), str(plugin.get_policy_plugin()),
+                           str(plugin.get_user_oriented()), str(plugin.get_version()),
+                           str(plugin.get_task_plugin()), str(plugin.get_x_based())]
+            plugin_id = self.db_service.upsert('plugin', plugin_columns, plugin_args, ['name', 'version'])
+
+            profile_rows.append([str(policy_id), str(profile.get_create_date()), str(profile.get_modify_date()),
+                                 str(profile.get_label()), str(profile.get_description()),
+                                 str(profile.get_overridable()), str(profile.get_active()), str(profile.get_deleted()),
+                                 str(profile.get_profile_data()), plugin_id])
+
+        if len(profile_rows) > 0:
+            self.db_service.update_many('profile', profile_columns, profile_rows)
 
     def get_active_policies(self, username):
+        policy, generation = self.policy_cache.get(username)
+        if policy is not None:
+            self.logger.debug('Active policies of {0} were found in cache'.format(username))
+            return policy
 
-        user_policy = self.db_service.select('policy', ['id', 'version', 'name'],
-                                             ' type=\'U\' and name=\'' + username + '\'')
-        ahenk_policy = self.db_service.select('policy', ['id', 'version'], ' type=\'A\' ')
+        policy = self.load_active_policies(username)
+        self.policy_cache.put(username, policy, generation)
+        return policy
 
+    def load_active_policies(self, username):
         plugin_columns = ['id', 'active', 'create_date', 'deleted', 'description', 'machine_oriented', 'modify_date',
                           'name', 'policy_plugin', 'user_oriented', 'version', 'task_plugin', 'x_based']
         profile_columns = ['id', 'create_date', 'label', 'description', 'overridable', 'active', 'deleted',
                            'profile_data', 'modify_date', 'plugin']
 
-        policy = PolicyBean(username=username)
+        # agent and user policies with their profiles and plugins in one query, profiles keep insertion order
+        sql = 'SELECT policy.type, policy.id, ' + \
+              ', '.join('profile.' + column for column in profile_columns) + ', ' + \
+              ', '.join('plugin.' + column for column in plugin_columns) + \
+              ' FROM policy LEFT JOIN profile ON profile.id = policy.id' \
+              ' LEFT JOIN plugin ON plugin.id = profile.plugin' \
+              ' WHERE policy.type = ? OR (policy.type = ? AND policy.name = ?)' \
+              ' ORDER BY policy.id, profile.rowid'
+        rows = self.db_service.fetch(['policy', 'profile', 'plugin'], sql, ['A', 'U', username], cached=True)
 
-        if len(user_policy) > 0:
-            user_policy_version = user_policy[0][0]
-            policy.set_user_policy_version(user_policy_version)
-            user_profiles = self.db_service.select('profile', profile_columns, ' id=' + str(user_policy_version) + ' ')
-            arr_profiles = []
-            if len(user_profiles) > 0:
-                for profile in user_profiles:
-                    plu = self.db_service.select('plugin', plugin_columns, ' id=\'' + profile[9] + '\'')[0]
-                    plugin = PluginBean(p_id=plu[0], active=plu[1], create_date=plu[2], deleted=plu[3],
-                                        description=plu[4], machine_oriented=plu[5], modify_date=plu[6], name=plu[7],
-                                        policy_plugin=plu[8], user_oriented=plu[9], version=plu[10],
-                                        task_plugin=plu[11], x_based=plu[12])
-
-                    arr_profiles.append(
-                        ProfileBean(profile[0], profile[1], profile[2], profile[3], profile[4], profile[5], profile[6],
-                                    profile[7], profile[8], plugin, policy.get_username()))
-                policy.set_user_profiles(arr_profiles)
-
-        if len(ahenk_policy) > 0:
-            ahenk_policy_version = ahenk_policy[0][0]
-            policy.set_ahenk_policy_version(ahenk_policy_version)
-            ahenk_profiles = self.db_service.select('profile', profile_columns,
-                                                    ' id=' + str(ahenk_policy_version) + ' ')
-            arr_profiles = []
-            if len(ahenk_profiles) > 0:
-                for profile in ahenk_profiles:
-                    plu = self.db_service.select('plugin', plugin_columns, ' id=\'' + profile[9] + '\'')[0]
-                    plugin = PluginBean(p_id=plu[0], active=plu[1], create_date=plu[2], deleted=plu[3],
-                                        description=plu[4], machine_oriented=plu[5], modify_date=plu[6], name=plu[7],
-                                        policy_plugin=plu[8], user_oriented=plu[9], version=plu[10],
-                                        task_plugin=plu[11], x_based=plu[12])
-
-                    arr_profiles.append(
-                        ProfileBean(profile[0], profile[1], profile[2], profile[3], profile[4], profile[5], profile[6],
-                                    profile[7], profile[8], plugin, policy.get_username()))
-                policy.set_ahenk_profiles(arr_profiles)
+        policy = PolicyBean(username=username)
+        policy_ids = dict()
+        profiles = {'A': [], 'U': []}
+
+        for row in rows:
+            policy_type, policy_id, profile, plu = row[0], row[1], row[2:12], row[12:]
+            if policy_ids.setdefault(policy_type, policy_id) != policy_id or profile[0] is None:
+                continue
+            if plu[0] is None:
+                self.logger.warning('Plugin {0} of profile could not be found. Profile is skipped.'.format(profile[9]))
+                continue
+            plugin = PluginBean(p_id=plu[0], active=plu[1], create_date=plu[2], deleted=plu[3],
+                                description=plu[4], machine_oriented=plu[5], modify_date=plu[6], name=plu[7],
+                                policy_plugin=plu[8], user_oriented=plu[9], version=plu[10],
+                                task_plugin=plu[11], x_based=plu[12])
+            profiles[policy_type].append(
+                ProfileBean(profile[0], profile[1], profile[2], profile[3], profile[4], profile[5], profile[6],
+                            profile[7], profile[8], plugin, policy.get_username()))
+
+        if 'U' in policy_ids:
+            policy.set_user_policy_version(policy_ids['U'])
+            if len(profiles['U']) > 0:
+                policy.set_user_profiles(profiles['U'])
+
+        if 'A' in policy_ids:
+            policy.set_ahenk_policy_version(policy_ids['A'])
+            if len(profiles['A']) > 0:
+                policy.set_ahenk_profiles(profiles['A'])
 
         return policy
 
     def execute_task(self, arg):
 
-        json_task = json.loads(arg)['task']
-        json_task = json.loads(json_task)
-        json_server_conf = json.dumps(json.loads(arg)['fileServerConf'])
+        task = BeanDecoder.task_message(arg)
+
+        result = self.task_manager.receive_task(task)
+        if result is False:
+            self.logger.info('Task {0} is already being executed, duplicate was ignored'.format(task.get_id()))
+            return
+        elif result is not None:
+            self.logger.info('Task {0} was already executed, its result is sent again'.format(task.get_id()))
+            Scope.get_instance().get_messenger().send_direct_message(result)
+            return
 
-        task = self.json_to_task_bean(json_task, json_server_conf)
         self.logger.debug('Adding new  task...Task is:{0}'.format(task.get_task_code()))
 
         self.task_manager.addTask(task)
         self.logger.debug('Task added')
 
     def json_to_task_bean(self, json_data, file_server_conf=None):
-        plu = json_data['plugin']
-        plugin = PluginBean(p_id=plu['id'], active=plu['active'], create_date=plu['createDate'], deleted=plu['deleted'],
-                            description=plu['description'], machine_oriented=plu['machineOriented'],
-                            modify_date=plu['modifyDate'], name=plu['name'], policy_plugin=plu['policyPlugin'],
-                            user_oriented=plu['userOriented'], version=plu['version'], task_plugin=plu['taskPlugin'],
-                            x_based=plu['xBased'])
-        return TaskBean(_id=json_data['id'], create_date=json_data['createDate'], modify_date=json_data['modifyDate'],
-                        task_code=json_data['taskCode'], parameter_map=json_data['parameterMap'],
-                        deleted=json_data['deleted'], plugin=plugin, cron_str=json_data['cronExpression'],
-                        file_server=str(file_server_conf))
+        return BeanDecoder.task(json_data, file_server_conf)
 
     def execute_script(self, arg):
+        if self.script_pool.submit(arg):
+            self.logger.debug('Script was queued')
+            return
+
+        self.logger.error('Script could not be queued, too many scripts are waiting')
+        data = dict()
+        data['type'] = 'SCRIPT_RESULT'
+        data['timestamp'] = str(Util.timestamp())
+        data['resultCode'] = '-1'
+        data['errorMessage'] = 'Agent is busy with other scripts, script was not executed'
+        Scope.get_instance().get_messenger().send_direct_message(json.dumps(data))
+
+    def run_script(self, arg):
         try:
             self.logger.debug('Executing script...')
             messenger = Scope().get_instance().get_messenger()
 
-            json_data = json.loads(arg)
-            result_code, p_out, p_err = Util.execute(str(json_data['command']))
+            json_data = arg
+            temp_full_path = System.Ahenk.received_dir_path() + str(Util.generate_uuid())
+            self.logger.debug('Writing result to file')
+            result_code, md5, p_err = Util.execute_to_file(str(json_data['command']), temp_full_path,
+                                                           timeout=self.script_timeout)
 
             self.logger.debug('Executed script')
 
@@ -388,11 +439,6 @@ class ExecutionManager(object):
             if result_code == 0:
                 self.logger.debug('Command execution was finished successfully')
                 try:
-                    temp_name = str(Util.generate_uuid())
-                    temp_full_path = System.Ahenk.received_dir_path() + temp_name
-                    self.logger.debug('Writing result to file')
-                    Util.write_file(temp_full_path, str(p_out))
-                    md5 = Util.get_md5_file(temp_full_path)
                     Util.rename_file(temp_full_path, System.Ahenk.received_dir_path() + md5)
 
                     file_manager = FileTransferManager(json_data['fileServerConf']['protocol'],
@@ -421,6 +467,7 @@ class ExecutionManager(object):
             else:
                 self.logger.error(
                     'Command execution was failed. Error Message :{0}'.format(str(result_code)))
+                Util.delete_file(temp_full_path)
                 data['resultCode'] = str(result_code)
                 data['errorMessage'] = str(p_err)
 
@@ -431,43 +478,4 @@ class ExecutionManager(object):
                     str(e)))
 
     def json_to_PolicyBean(self, json_data):
-
-        username = json_data['username']
-        ahenk_prof_json_arr = json_data['agentPolicyProfiles']
-        user_prof_json_arr = json_data['userPolicyProfiles']
-
-        ahenk_prof_arr = []
-        user_prof_arr = []
-        if ahenk_prof_json_arr is not None:
-            for prof in ahenk_prof_json_arr:
-                plu = json.loads(json.dumps(prof['plugin']))
-                plugin = PluginBean(p_id=plu['id'], active=plu['active'], create_date=plu['createDate'],
-                                    deleted=plu['deleted'], description=plu['description'],
-                                    machine_oriented=plu['machineOriented'], modify_date=plu['modifyDate'],
-                                    name=plu['name'], policy_plugin=plu['policyPlugin'],
-                                    user_oriented=plu['userOriented'], version=plu['version'],
-                                    task_plugin=plu['taskPlugin'], x_based=plu['xBased'])
-                ahenk_prof_arr.append(
-                    ProfileBean(prof['id'], prof['createDate'], prof['label'], prof['description'], prof['overridable'],
-                                prof['active'], prof['deleted'], json.dumps(prof['profileData']), prof['modifyDate'],
-                                plugin, username))
-
-        if user_prof_json_arr is not None:
-            for prof in user_prof_json_arr:
-                plu = json.loads(json.dumps(prof['plugin']))
-                plugin = PluginBean(p_id=plu['id'], active=plu['active'], create_date=plu['createDate'],
-                                    deleted=plu['deleted'], description=plu['description'],
-                                    machine_oriented=plu['machineOriented'], modify_date=plu['modifyDate'],
-                                    name=plu['name'], policy_plugin=plu['policyPlugin'],
-                                    user_oriented=plu['userOriented'], version=plu['version'],
-                                    task_plugin=plu['taskPlugin'], x_based=plu['xBased'])
-                user_prof_arr.append(
-                    ProfileBean(prof['id'], prof['createDate'], prof['label'], prof['description'], prof['overridable'],
-                                prof['active'], prof['deleted'], json.dumps(prof['profileData']), prof['modifyDate'],
-                                plugin, username))
-
-        return PolicyBean(ahenk_policy_version=json_data['agentPolicyVersion'],
-                          user_policy_version=json_data['userPolicyVersion'], ahenk_profiles=ahenk_prof_arr,
-                          user_profiles=user_prof_arr, timestamp=json_data['timestamp'], username=json_data['username'],
-                          agent_execution_id=json_data['agentCommandExecutionId'],
-                          user_execution_id=json_data['userCommandExecutionId'])
+        return BeanDecoder.policy(json_data)
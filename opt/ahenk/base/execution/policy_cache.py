@@ -0,0 +1,45 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import copy
+import threading
+from collections import OrderedDict
+
+
+class PolicyCache(object):
+    """
+        Bounded LRU cache of resolved policies of users.
+        Agent policy is shared by all users, so a change on it drops every entry while a change on a user policy
+        drops only the entry of that user. Copies are returned since policy processing modifies profiles.
+    """
+
+    def __init__(self, max_size=32):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.generation = 0
+
+    def get(self, username):
+        with self.lock:
+            if username not in self.entries:
+                return None, self.generation
+            self.entries.move_to_end(username)
+            return copy.deepcopy(self.entries[username]), self.generation
+
+    def put(self, username, policy, generation):
+        with self.lock:
+            # policy was read before an invalidation
+            if generation != self.generation:
+                return
+            self.entries[username] = copy.deepcopy(policy)
+            self.entries.move_to_end(username)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, username=None):
+        with self.lock:
+            self.generation += 1
+            if username is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(username, None)
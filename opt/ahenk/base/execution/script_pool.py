@@ -0,0 +1,42 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import queue
+import threading
+
+from base.scope import Scope
+
+
+class ScriptPool(object):
+    """
+        Bounded pool of worker threads running script requests, keeps slow scripts off the messaging thread.
+        Requests wait in a bounded queue; submit returns False when the queue is full.
+    """
+
+    def __init__(self, handler, worker_count=2, queue_size=10):
+        self.logger = Scope.get_instance().get_logger()
+        self.handler = handler
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.workers = []
+        for index in range(worker_count):
+            worker = threading.Thread(target=self.work, name='ScriptWorker-{0}'.format(index))
+            worker.setDaemon(True)
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, arg):
+        try:
+            self.queue.put_nowait(arg)
+            return True
+        except queue.Full:
+            return False
+
+    def work(self):
+        while True:
+            arg = self.queue.get(block=True)
+            try:
+                self.handler(arg)
+            except Exception as e:
+                self.logger.error('A problem occurred while running script. Error Message: {0}'.format(str(e)))
+            finally:
+                self.queue.task_done()
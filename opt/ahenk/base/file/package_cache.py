@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+
+from base.scope import Scope
+from base.util.util import Util
+
+
+class PackageCache(object):
+    """
+        Size bounded, content addressed cache of downloaded plugin packages.
+        Packages are kept as <plugin>_<version>_<md5>.deb, md5 of a package is verified before it is used.
+        Least recently used packages are removed when total size exceeds the limit.
+    """
+
+    def __init__(self):
+        scope = Scope.get_instance()
+        self.logger = scope.get_logger()
+        config = scope.get_configuration_manager()
+        self.path = config.get('PLUGIN', 'package_cache_path', fallback='/var/cache/ahenk/plugins/')
+        self.max_size = int(config.get('PLUGIN', 'package_cache_size', fallback='104857600'))
+        self.lock = threading.Lock()
+
+    def is_enabled(self):
+        return self.max_size > 0
+
+    @staticmethod
+    def entry_name(plugin_name, plugin_version, md5):
+        return '{0}_{1}_{2}.deb'.format(str(plugin_name).replace(os.sep, ''), str(plugin_version).replace(os.sep, ''),
+                                        md5)
+
+    def entries(self):
+        entries = []
+        if Util.is_exist(self.path):
+            for file_name in os.listdir(self.path):
+                parts = file_name[:-len('.deb')].rsplit('_', 2)
+                if file_name.endswith('.deb') and len(parts) == 3:
+                    entries.append((parts[0], parts[1], parts[2], os.path.join(self.path, file_name)))
+        return entries
+
+    def get(self, plugin_name, plugin_version, md5=None):
+        """
+            Returns path of a verified cached package of plugin version or None.
+        """
+        if not self.is_enabled():
+            return None
+        with self.lock:
+            key = (str(plugin_name).replace(os.sep, ''), str(plugin_version).replace(os.sep, ''))
+            candidates = []
+            for name, version, entry_md5, path in self.entries():
+                if (name, version) == key and (md5 is None or entry_md5 == md5):
+                    candidates.append((os.path.getmtime(path), entry_md5, path))
+
+            for mtime, entry_md5, path in sorted(candidates, reverse=True):
+                if Util.get_md5_file(path) == entry_md5:
+                    # mtime keeps the last use for eviction
+                    os.utime(path)
+                    return path
+                self.logger.warning('Cached package {0} is corrupted, it will be removed'.format(path))
+                Util.delete_file(path)
+        return None
+
+    def put(self, plugin_name, plugin_version, file_path, md5=None):
+        """
+            Moves downloaded package into cache and returns its new path. If expected md5 is given, package is
+            checked against it first, a mismatching package is deleted and ValueError is raised.
+        """
+        file_md5 = Util.get_md5_file(file_path)
+        if md5 is not None and str(md5).lower() != file_md5:
+            Util.delete_file(file_path)
+            raise ValueError('md5 of downloaded package {0} does not match expected md5 {1}'.format(file_md5, md5))
+
+        if not self.is_enabled():
+            return file_path
+        with self.lock:
+            if not Util.is_exist(self.path):
+                Util.create_directory(self.path)
+            cached_path = os.path.join(self.path, self.entry_name(plugin_name, plugin_version, file_md5))
+            # received and cache directories may be on different file systems
+            Util.move(file_path, cached_path)
+            os.utime(cached_path)
+            self.evict(cached_path)
+            return cached_path
+
+    def evict(self, keep_path):
+        entries = sorted((os.path.getmtime(path), os.path.getsize(path), path) for name, version, md5, path in
+                         self.entries())
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in entries:
+            if total <= self.max_size:
+                break
+            if path != keep_path:
+                self.logger.debug('Package {0} is removed from cache'.format(path))
+                Util.delete_file(path)
+                total -= size
@@ -89,7 +89,7 @@ class AnonymousMessenger(ClientXMPP):
             self.disconnect()
             j = json.loads(str(msg['body']))
             message_type = j['type']
-            self.event_manager.fireEvent(message_type, str(msg['body']))
+            self.event_manager.fireEvent(message_type, j)
 
     def send_direct_message(self, msg):
         self.logger.debug('<<--------Sending message: {0}'.format(msg))
@@ -87,9 +87,10 @@ class Messaging(object):
         data = dict()
         data['type'] = 'GET_POLICIES'
 
-        user_policy_number = self.db_service.select_one_result('policy', 'version',
-                                                               'type = \'U\' and name = \'' + username + '\'')
-        machine_policy_number = self.db_service.select_one_result('policy', 'version', 'type = \'A\'')
+        user_policy_number = self.db_service.select_one_result('policy', 'version', 'type = ? and name = ?',
+                                                               ['U', username], cached=True)
+        machine_policy_number = self.db_service.select_one_result('policy', 'version', 'type = ?', ['A'],
+                                                                  cached=True)
 
         data['userPolicyVersion'] = user_policy_number
         data['agentPolicyVersion'] = machine_policy_number
@@ -103,17 +104,17 @@ class Messaging(object):
     def registration_msg(self):
         data = dict()
         data['type'] = 'REGISTER'
-        data['from'] = self.db_service.select_one_result('registration', 'jid', ' 1=1')
-        data['password'] = self.db_service.select_one_result('registration', 'password', ' 1=1')
+        data['from'] = self.db_service.select_one_result('registration', 'jid')
+        data['password'] = self.db_service.select_one_result('registration', 'password')
 
-        params = self.db_service.select_one_result('registration', 'params', ' 1=1')
+        params = self.db_service.select_one_result('registration', 'params')
         data['data'] = json.loads(str(params))
         json_params = json.loads(str(params))
         data['macAddresses'] = json_params['macAddresses']
         data['ipAddresses'] = json_params['ipAddresses']
         data['hostname'] = json_params['hostname']
 
-        data['timestamp'] = self.db_service.select_one_result('registration', 'timestamp', ' 1=1')
+        data['timestamp'] = self.db_service.select_one_result('registration', 'timestamp')
         json_data = json.dumps(data)
         self.logger.debug('Registration message was created')
         return json_data
@@ -2,11 +2,11 @@
 # -*- coding: utf-8 -*-
 # Author: Volkan Şahin <volkansah.in> <bm.volkansahin@gmail.com>
 # Author: İsmail BAŞARAN <ismail.basaran@tubitak.gov.tr> <basaran.ismaill@gmail.com>
-import json
 import sys
 import socket
 from sleekxmpp import ClientXMPP
 
+from base.model.bean_decoder import BeanDecoder
 from base.scope import Scope
 
 sys.path.append('../..')
@@ -101,9 +101,9 @@ class Messenger(ClientXMPP):
         if msg['type'] in ['normal']:
             self.logger.info('---------->Received message: {0}'.format(str(msg['body'])))
             try:
-                j = json.loads(str(msg['body']))
+                j = BeanDecoder.loads(str(msg['body']))
                 message_type = j['type']
-                self.event_manger.fireEvent(message_type, str(msg['body']))
+                self.event_manger.fireEvent(message_type, j)
                 self.logger.debug('Fired event is: {0}'.format(message_type))
             except Exception as e:
                 self.logger.error(
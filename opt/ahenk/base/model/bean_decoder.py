@@ -0,0 +1,79 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from base.model.plugin_bean import PluginBean
+from base.model.policy_bean import PolicyBean
+from base.model.profile_bean import ProfileBean
+from base.model.task_bean import TaskBean
+
+
+class BeanDecoder(object):
+    """
+        Turns Lider messages into beans. Messages are parsed once by messenger and decoded messages are passed
+        to handlers. orjson is used for parsing when it is installed, encoding always uses json module so stored
+        profile data and its hashes do not depend on installed backend.
+    """
+
+    @staticmethod
+    def loads(text):
+        if orjson is not None:
+            return orjson.loads(text)
+        return json.loads(text)
+
+    @staticmethod
+    def dumps(data):
+        return json.dumps(data)
+
+    @staticmethod
+    def plugin(data):
+        return PluginBean(p_id=data['id'], active=data['active'], create_date=data['createDate'],
+                          deleted=data['deleted'], description=data['description'],
+                          machine_oriented=data['machineOriented'], modify_date=data['modifyDate'],
+                          name=data['name'], policy_plugin=data['policyPlugin'], user_oriented=data['userOriented'],
+                          version=data['version'], task_plugin=data['taskPlugin'], x_based=data['xBased'])
+
+    @staticmethod
+    def profile(data, username):
+        return ProfileBean(data['id'], data['createDate'], data['label'], data['description'], data['overridable'],
+                           data['active'], data['deleted'], BeanDecoder.dumps(data['profileData']),
+                           data['modifyDate'], BeanDecoder.plugin(data['plugin']), username)
+
+    @staticmethod
+    def policy(data):
+        username = data['username']
+        ahenk_profiles = [BeanDecoder.profile(profile, username) for profile in data['agentPolicyProfiles'] or []]
+        user_profiles = [BeanDecoder.profile(profile, username) for profile in data['userPolicyProfiles'] or []]
+
+        return PolicyBean(ahenk_policy_version=data['agentPolicyVersion'],
+                          user_policy_version=data['userPolicyVersion'], ahenk_profiles=ahenk_profiles,
+                          user_profiles=user_profiles, timestamp=data['timestamp'], username=username,
+                          agent_execution_id=data['agentCommandExecutionId'],
+                          user_execution_id=data['userCommandExecutionId'])
+
+    @staticmethod
+    def task(data, file_server_conf=None):
+        return TaskBean(_id=data['id'], create_date=data['createDate'], modify_date=data['modifyDate'],
+                        task_code=data['taskCode'], parameter_map=data['parameterMap'], deleted=data['deleted'],
+                        plugin=BeanDecoder.plugin(data['plugin']), cron_str=data['cronExpression'],
+                        file_server=str(file_server_conf))
+
+    @staticmethod
+    def policy_message(message):
+        return BeanDecoder.policy(message)
+
+    @staticmethod
+    def task_message(message):
+        """
+            Task is sent as an encoded json string inside message, file server configuration is kept encoded in task.
+        """
+        task = message['task']
+        if isinstance(task, str):
+            task = BeanDecoder.loads(task)
+        return BeanDecoder.task(task, BeanDecoder.dumps(message['fileServerConf']))
@@ -4,8 +4,8 @@
 
 
 class InitMode(object):
-    def __init__(self):
-        pass
+    def __init__(self, barrier=None):
+        self.barrier = barrier
 
     @property
     def obj_name(self):
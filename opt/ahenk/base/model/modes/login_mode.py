@@ -4,8 +4,9 @@
 
 
 class LoginMode(object):
-    def __init__(self, username):
+    def __init__(self, username, barrier=None):
         self.username = username
+        self.barrier = barrier
 
     @property
     def obj_name(self):
@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+from base.scope import Scope
+
+
+class ModeBarrier(object):
+    """
+        Completes when every plugin which a mode was sent to has finished its mode handler. Plugins are added while
+        the mode is sent, the barrier can only complete after it is sealed.
+        Keeps how long each plugin took and which plugins timed out or failed.
+    """
+
+    def __init__(self, mode_type):
+        self.logger = Scope.get_instance().get_logger()
+        self.mode_type = mode_type
+        self.pending = set()
+        self.sealed = False
+        self.durations = dict()
+        self.failed = set()
+        self.start_time = time.time()
+        self.end_time = None
+        self.condition = threading.Condition()
+
+    def add(self, plugin_name):
+        with self.condition:
+            self.pending.add(plugin_name)
+
+    def seal(self):
+        with self.condition:
+            self.sealed = True
+            self.complete()
+
+    def discard(self, plugin_name):
+        """
+            Removes a plugin which mode could not be sent to.
+        """
+        with self.condition:
+            self.pending.discard(plugin_name)
+            self.complete()
+
+    def done(self, plugin_name, duration, success=True):
+        with self.condition:
+            if plugin_name not in self.pending:
+                return
+            self.pending.discard(plugin_name)
+            self.durations[plugin_name] = duration
+            if not success:
+                self.failed.add(plugin_name)
+            self.complete()
+
+    def complete(self):
+        if not self.sealed or self.pending or self.end_time is not None:
+            return
+        self.end_time = time.time()
+        self.condition.notify_all()
+        if not self.durations:
+            return
+        self.logger.info('{0} mode was completed by {1} plugins in {2:.2f} seconds. Durations: {3}{4}'.format(
+            self.mode_type, len(self.durations), self.elapsed(),
+            ', '.join('{0}={1:.2f}'.format(name, duration) for name, duration in sorted(self.durations.items())),
+            '. Failed: {0}'.format(', '.join(sorted(self.failed))) if self.failed else ''))
+
+    def wait(self, timeout=None):
+        """
+            Waits until all plugins finish the mode, returns False if timeout expires before.
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.end_time is not None, timeout):
+                self.logger.warning('{0} mode is not completed in {1} seconds. Waiting plugins: {2}'.format(
+                    self.mode_type, str(timeout), ', '.join(sorted(self.pending))))
+                return False
+            return True
+
+    def is_done(self):
+        with self.condition:
+            return self.end_time is not None
+
+    def elapsed(self):
+        return (self.end_time or time.time()) - self.start_time
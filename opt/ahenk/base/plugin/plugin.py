@@ -3,14 +3,19 @@
 # Author: İsmail BAŞARAN <ismail.basaran@tubitak.gov.tr> <basaran.ismaill@gmail.com>
 # Author: Volkan Şahin <volkansah.in> <bm.volkansahin@gmail.com>
 
+import ast
+import concurrent.futures
 import json
+import queue
 import threading
+import time
 
 from base.file.file_transfer_manager import FileTransferManager
 from base.model.enum.content_type import ContentType
 from base.model.enum.message_code import MessageCode
 from base.model.enum.message_type import MessageType
 from base.model.response import Response
+from base.plugin.profile_history import ProfileHistory
 from base.scope import Scope
 from base.system.system import System
 from base.util.util import Util
@@ -20,6 +25,26 @@ class Context(object):
     def __init__(self):
         self.data = dict()
         self.scope = Scope().get_instance()
+        self.cancel_event = threading.Event()
+        self.deadline = None
+
+    def start(self, timeout=None):
+        """
+            Starts a new item with a fresh cancellation token, handlers should check is_cancelled() in long loops.
+        """
+        self.cancel_event = threading.Event()
+        self.deadline = time.monotonic() + timeout if timeout else None
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def is_cancelled(self):
+        return self.cancel_event.is_set() or (self.deadline is not None and time.monotonic() >= self.deadline)
+
+    def remaining(self):
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0)
 
     def put(self, var_name, data):
         self.data[var_name] = data
@@ -54,33 +79,84 @@ class Context(object):
         return success
 
 
+class HandlerThread(threading.Thread):
+    """
+        Runs handlers of a plugin worker one after another. Handlers reuse the same thread, so thread bound
+        resources like database connection are created once for a worker instead of once for each item.
+    """
+
+    def __init__(self, name):
+        threading.Thread.__init__(self, name=name)
+        self.daemon = True
+        self.items = queue.Queue()
+
+    def submit(self, function, *args):
+        future = concurrent.futures.Future()
+        self.items.put((function, args, future))
+        return future
+
+    def stop(self):
+        """
+            Thread stops after its current handler returns.
+        """
+        self.items.put((None, None, None))
+
+    def run(self):
+        while True:
+            function, args, future = self.items.get()
+            if function is None:
+                return
+            try:
+                future.set_result(function(*args))
+            except Exception as e:
+                future.set_exception(e)
+
+
 class Plugin(threading.Thread):
     """
         This is a thread inherit class and have a queue.
         Plugin class responsible for processing TASK or USER PLUGIN PROFILE.
     """
 
-    def __init__(self, name, in_ueue):
+    def __init__(self, name, in_ueue, mode_handler=True, context=None, idle_timeout=None, idle_callback=None):
         threading.Thread.__init__(self)
         self.name = name
         self.in_queue = in_ueue
+        # only one of the workers of a plugin runs its mode handlers
+        self.mode_handler = mode_handler
+        self.idle_timeout = idle_timeout
+        self.idle_callback = idle_callback
 
         scope = Scope.get_instance()
         self.logger = scope.get_logger()
         self.response_queue = scope.get_response_queue()
         self.messaging = scope.get_message_manager()
         self.db_service = scope.get_db_service()
+        self.profile_history = ProfileHistory()
+
+        config_manager = scope.get_configuration_manager()
+        self.task_timeout = int(config_manager.get('PLUGIN', 'task_timeout', fallback='600'))
+        self.profile_timeout = int(config_manager.get('PLUGIN', 'profile_timeout', fallback='600'))
+        self.mode_timeout = int(config_manager.get('PLUGIN', 'mode_timeout', fallback='60'))
 
         self.keep_run = True
-        self.context = Context()
+        self.context = context if context is not None else Context()
+        self.handler_thread = None
 
     def run(self):
 
         while self.keep_run:
+            item_obj = None
+            answered = False
             try:
                 try:
-                    item_obj = self.in_queue.get(block=True)
+                    item_obj = self.in_queue.get(block=True, timeout=self.idle_timeout)
                     obj_name = item_obj.obj_name
+                except queue.Empty:
+                    if self.idle_callback is None or self.idle_callback(self):
+                        self.logger.debug('[Plugin] {0} plugin worker is idle, it is stopping'.format(self.name))
+                        self.keep_run = False
+                    continue
                 except Exception as e:
                     self.logger.error(
                         '[Plugin] A problem occurred while executing process. Error Message: {0}'.format(str(e)))
@@ -105,12 +181,21 @@ class Plugin(threading.Thread):
                                              user)
 
                     self.logger.debug('[Plugin] Handling task')
-                    Scope.get_instance().get_plugin_manager().find_command(self.getName(),
-                                                                           item_obj.get_plugin().get_version(),
-                                                                           item_obj.get_task_code().lower()).handle_task(
-                        task_data, self.context)
+                    plugin_manager = Scope.get_instance().get_plugin_manager()
+                    timeout = self.item_timeout(task_data, self.task_timeout)
+                    completed = self.call_handler(plugin_manager.find_command(self.getName(),
+                                                                              item_obj.get_plugin().get_version(),
+                                                                              item_obj.get_task_code().lower()),
+                                                  'handle_task', [task_data], timeout)
+
+                    if not completed:
+                        self.logger.error(
+                            '[Plugin] Task {0} of {1} plugin timed out after {2} seconds'.format(
+                                str(item_obj.get_id()), self.getName(), str(timeout)))
+                        self.send_task_error(item_obj,
+                                             'Task was cancelled after {0} seconds timeout'.format(str(timeout)))
 
-                    if self.context.data is not None and self.context.get('responseCode') is not None:
+                    elif self.context.data is not None and self.context.data.get('responseCode') is not None:
                         self.logger.debug('[Plugin] Creating response')
                         response = Response(type=MessageType.TASK_STATUS.value, id=item_obj.get_id(),
                                             code=self.context.get('responseCode'),
@@ -143,16 +228,18 @@ class Plugin(threading.Thread):
                                                     message='Task processed successfully but file transfer not completed. Check defined server conf')
                                 message = self.messaging.task_status_msg(response)
 
-                            Scope.get_instance().get_messenger().send_direct_message(message)
-
                         else:
                             self.logger.debug('[Plugin] Sending task response')
-                            Scope.get_instance().get_messenger().send_direct_message(
-                                self.messaging.task_status_msg(response))
+                            message = self.messaging.task_status_msg(response)
+
+                        Scope.get_instance().get_task_manager().save_task_result(item_obj.get_id(), message)
+                        answered = True
+                        Scope.get_instance().get_messenger().send_direct_message(message)
 
                     else:
                         self.logger.error(
                             '[Plugin] There is no Response. Plugin must create response after run a task!')
+                        self.send_task_error(item_obj, 'Plugin did not create a response for the task')
 
                 elif obj_name == "PROFILE":
 
@@ -177,11 +264,26 @@ class Plugin(threading.Thread):
                                      System.Sessions.display(item_obj.get_username()),
                                      item_obj.get_username())
                     self.logger.debug('[Plugin] Handling profile')
-                    Scope.get_instance().get_plugin_manager().find_policy_module(item_obj.get_plugin().get_name(),
-                                                                                 item_obj.get_plugin().get_version()).handle_policy(
-                        profile_data, self.context)
+                    plugin_manager = Scope.get_instance().get_plugin_manager()
+                    timeout = self.item_timeout(profile_data, self.profile_timeout)
+                    module = plugin_manager.find_policy_module(item_obj.get_plugin().get_name(),
+                                                               item_obj.get_plugin().get_version())
+                    completed = self.call_handler(module, 'handle_policy', [profile_data], timeout)
 
-                    if self.context.data is not None and self.context.get('responseCode') is not None:
+                    if not completed:
+                        self.logger.error(
+                            '[Plugin] Profile {0} of {1} plugin timed out after {2} seconds'.format(
+                                str(item_obj.get_id()), self.getName(), str(timeout)))
+                        response = Response(type=MessageType.POLICY_STATUS.value, id=item_obj.get_id(),
+                                            code=MessageCode.POLICY_ERROR.value,
+                                            message='Profile was cancelled after {0} seconds timeout'.format(
+                                                str(timeout)),
+                                            execution_id=execution_id, policy_version=policy_ver)
+                        Scope.get_instance().get_messenger().send_direct_message(
+                            self.messaging.policy_status_msg(response))
+
+                    elif self.context.data is not None and self.context.data.get('responseCode') is not None:
+                        self.profile_history.save(item_obj, self.context.get('responseCode'))
                         self.logger.debug('[Plugin] Creating response')
                         response = Response(type=MessageType.POLICY_STATUS.value, id=item_obj.get_id(),
                                             code=self.context.get('responseCode'),
@@ -223,18 +325,32 @@ class Plugin(threading.Thread):
                         self.logger.error(
                             '[Plugin] There is no Response. Plugin must create response after run a policy!')
                 elif 'MODE' in obj_name:
-                    module = Scope.get_instance().get_plugin_manager().find_module(obj_name, self.name)
-                    if module is not None:
-                        if item_obj.obj_name in ('LOGIN_MODE', 'LOGOUT_MODE', 'SAFE_MODE'):
-                            self.context.put('username', item_obj.username)
-                        try:
+                    start_time = time.time()
+                    success = False
+                    try:
+                        module = None
+                        if self.mode_handler:
+                            module = Scope.get_instance().get_plugin_manager().find_module(obj_name, self.name)
+                        if module is not None:
+                            if item_obj.obj_name in ('LOGIN_MODE', 'LOGOUT_MODE', 'SAFE_MODE'):
+                                self.context.put('username', item_obj.username)
                             self.logger.debug(
                                 '[Plugin] {0} is running on {1} plugin'.format(str(item_obj.obj_name), str(self.name)))
-                            module.handle_mode(self.context)
-                        except Exception as e:
-                            self.logger.error(
-                                '[Plugin] A problem occurred while running {0} on {1} plugin. Error Message: {2}'.format(
-                                    str(obj_name), str(self.name), str(e)))
+                            success = self.call_handler(module, 'handle_mode', [], self.mode_timeout)
+                            if not success:
+                                self.logger.error(
+                                    '[Plugin] {0} of {1} plugin timed out after {2} seconds'.format(
+                                        str(obj_name), str(self.name), str(self.mode_timeout)))
+                        else:
+                            success = True
+                    except Exception as e:
+                        self.logger.error(
+                            '[Plugin] A problem occurred while running {0} on {1} plugin. Error Message: {2}'.format(
+                                str(obj_name), str(self.name), str(e)))
+                    finally:
+                        # barrier is completed even if mode module could not be loaded
+                        if self.mode_handler and item_obj.barrier is not None:
+                            item_obj.barrier.done(self.name, time.time() - start_time, success)
 
                     if item_obj.obj_name is 'SHUTDOWN_MODE':
                         self.logger.debug('[Plugin] {0} plugin is stopping...'.format(str(self.name)))
@@ -245,10 +361,83 @@ class Plugin(threading.Thread):
                 self.context.empty_data()
             except Exception as e:
                 self.logger.error("[Plugin] Plugin running exception. Exception Message: {0} ".format(str(e)))
+                if item_obj is not None and item_obj.obj_name == 'TASK' and not answered:
+                    self.send_task_error(item_obj, 'Task could not be executed. Error Message: {0}'.format(str(e)))
+                self.context.empty_data()
+
+        if self.handler_thread is not None:
+            self.handler_thread.stop()
+            self.handler_thread = None
+
+    def send_task_error(self, task, message):
+        """
+            Sends a TASK_ERROR status for task and stores it as result, so re-sent task is answered with it.
+        """
+        try:
+            response = Response(type=MessageType.TASK_STATUS.value, id=task.get_id(),
+                                code=MessageCode.TASK_ERROR.value, message=message)
+            status_message = self.messaging.task_status_msg(response)
+            Scope.get_instance().get_task_manager().save_task_result(task.get_id(), status_message)
+            Scope.get_instance().get_messenger().send_direct_message(status_message)
+        except Exception as e:
+            self.logger.error(
+                '[Plugin] A problem occurred while sending task error. Error Message: {0}'.format(str(e)))
+
+    def item_timeout(self, data, default):
+        """
+            Returns executionTimeout of task parameters or profile data, or default. Profile data is kept as json and
+            parameters of a task read from database as python literal, both are decoded first.
+        """
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        if isinstance(data, str):
+            try:
+                data = json.loads(data)
+            except ValueError:
+                try:
+                    data = ast.literal_eval(data)
+                except (ValueError, SyntaxError):
+                    return default
+        if not isinstance(data, dict) or data.get('executionTimeout') is None:
+            return default
+        try:
+            return int(data['executionTimeout'])
+        except (TypeError, ValueError):
+            self.logger.warning('[Plugin] Invalid executionTimeout {0} for {1} plugin, {2} seconds is used'.format(
+                str(data['executionTimeout']), self.name, str(default)))
+            return default
+
+    def call_handler(self, module, function_name, args, timeout):
+        """
+            Runs handler with a deadline on handler thread of worker. If handler does not finish in time its context
+            is cancelled and left to it together with the handler thread, worker continues with a new context and
+            starts a new handler thread for the next item. Returns False on timeout.
+        """
+        plugin_manager = Scope.get_instance().get_plugin_manager()
+        context = self.context
+        context.start(timeout)
+        if not timeout:
+            plugin_manager.run_handler(self.name, module, function_name, args, context)
+            return True
+
+        if self.handler_thread is None:
+            self.handler_thread = HandlerThread('{0}-handler'.format(self.name))
+            self.handler_thread.start()
+        future = self.handler_thread.submit(plugin_manager.run_handler, self.name, module, function_name, args,
+                                            context)
+        done, not_done = concurrent.futures.wait([future], timeout)
+        if not done:
+            context.cancel()
+            self.context = Context()
+            self.handler_thread.stop()
+            self.handler_thread = None
+            return False
+        future.result()
+        return True
 
     def get_execution_id(self, profile_id):
         try:
-            return self.db_service.select_one_result('policy', 'execution_id', ' id={0}'.format(profile_id))
+            return self.db_service.select_one_result('policy', 'execution_id', 'id = ?', [profile_id], cached=True)
         except Exception as e:
             self.logger.error(
                 "[Plugin] A problem occurred while getting execution id. Exception Message: {0} ".format(str(e)))
@@ -256,7 +445,7 @@ class Plugin(threading.Thread):
 
     def get_policy_version(self, profile_id):
         try:
-            return self.db_service.select_one_result('policy', 'version', ' id={0}'.format(profile_id))
+            return self.db_service.select_one_result('policy', 'version', 'id = ?', [profile_id], cached=True)
         except Exception as e:
             self.logger.error(
                 "[Plugin] A problem occurred while getting policy version . Exception Message: {0} ".format(str(e)))
@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import itertools
+import threading
+import zlib
+
+from base.plugin.plugin import Context
+from base.plugin.plugin_queue import PluginQueue
+
+
+class PluginDispatcher(object):
+    """
+        Distributes items of a plugin to the queues of its workers.
+        Items with same ordering key always go to the same worker, so they are processed in order. Profiles are keyed
+        by username by default, items without key are distributed round robin. Modes are handled by the first worker,
+        shutdown mode is sent to every running worker to stop them all.
+        Workers are started when an item arrives for them and released after they stay idle, contexts of workers are
+        kept for their next threads. Queues of workers are priority queues aged by given seconds and bounded by
+        max_size, overflowing items are rejected or replace the oldest scheduled task when drop_oldest is set.
+    """
+
+    def __init__(self, worker_count, worker_factory, key_function=None, worker_released=None, aging=None,
+                 max_size=0, drop_oldest=False):
+        count = max(worker_count, 1)
+        self.queues = [PluginQueue(max_size, aging) for index in range(count)]
+        self.drop_oldest = drop_oldest
+        self.contexts = [Context() for index in range(count)]
+        self.workers = [None] * count
+        self.worker_factory = worker_factory
+        self.worker_released = worker_released
+        self.key_function = key_function
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        self.activated = False
+
+    def ordering_key(self, item):
+        if self.key_function is not None:
+            return self.key_function(item)
+        if item.obj_name == 'PROFILE':
+            return item.get_username() or ''
+        return None
+
+    def select(self, item):
+        if len(self.queues) == 1 or 'MODE' in item.obj_name:
+            return 0
+        key = self.ordering_key(item)
+        if key is None:
+            return next(self.counter) % len(self.queues)
+        return zlib.crc32(str(key).encode('utf-8')) % len(self.queues)
+
+    def is_running(self, index):
+        return self.workers[index] is not None and self.workers[index].is_alive()
+
+    def start_worker(self, index):
+        self.workers[index] = self.worker_factory(index, self.queues[index], self.contexts[index], self.release)
+
+    def start(self):
+        with self.lock:
+            self.activated = True
+            for index in range(len(self.queues)):
+                if not self.is_running(index):
+                    self.start_worker(index)
+
+    def put(self, item, block=True, timeout=None):
+        """
+            Queues item and starts its worker if needed. Returns a tuple of accepted flag and the scheduled task
+            dropped for the item.
+        """
+        accepted, dropped = True, None
+        with self.lock:
+            if item.obj_name == 'SHUTDOWN_MODE':
+                if not self.activated:
+                    return accepted, dropped
+                for index, queue in enumerate(self.queues):
+                    # first worker runs shutdown handler even if it was released before
+                    if index == 0 or self.is_running(index):
+                        queue.offer(item)
+            else:
+                accepted, dropped = self.queues[self.select(item)].offer(item, self.drop_oldest)
+                self.activated = True
+
+            for index, queue in enumerate(self.queues):
+                if not queue.empty() and not self.is_running(index):
+                    self.start_worker(index)
+        return accepted, dropped
+
+    def defer(self, item):
+        """
+            Queues item without starting a worker, it is processed when the plugin is activated.
+        """
+        with self.lock:
+            self.queues[self.select(item)].offer(item)
+
+    def release(self, worker):
+        """
+            Called by an idle worker, returns True if the worker can stop.
+        """
+        with self.lock:
+            for index, current in enumerate(self.workers):
+                if current is worker:
+                    if not self.queues[index].empty():
+                        return False
+                    # worker replaces its context when a timed out handler keeps the old one
+                    self.contexts[index] = worker.context
+                    self.workers[index] = None
+        if self.worker_released is not None:
+            self.worker_released(worker)
+        return True
+
+    def qsize(self):
+        return sum(queue.qsize() for queue in self.queues)
+
+    def metrics(self):
+        return [queue.metrics() for queue in self.queues]
+
+    def __contains__(self, item):
+        return any(item in queue for queue in self.queues)
@@ -2,19 +2,29 @@
 # -*- coding: utf-8 -*-
 # Author: İsmail BAŞARAN <ismail.basaran@tubitak.gov.tr> <basaran.ismaill@gmail.com>
 # Author: Volkan Şahin <volkansah.in> <bm.volkansahin@gmail.com>
-import imp
+import functools
+import importlib.util
 import os
+import sys
+import threading
 
 from base.scope import Scope
+from base.model.enum.message_code import MessageCode
+from base.model.enum.message_type import MessageType
 from base.model.plugin_bean import PluginBean
+from base.model.response import Response
 from base.model.modes.init_mode import InitMode
 from base.model.modes.login_mode import LoginMode
 from base.model.modes.logout_mode import LogoutMode
 from base.model.modes.safe_mode import SafeMode
 from base.model.modes.shutdown_mode import ShutdownMode
+from base.plugin.mode_barrier import ModeBarrier
 from base.plugin.plugin import Plugin
-from base.plugin.plugin_queue import PluginQueue
+from base.plugin.plugin_dispatcher import PluginDispatcher
+from base.plugin.plugin_process_pool import PluginProcessPool
+from base.plugin.plugin_registry import PluginRegistry
 from base.plugin.plugin_install_listener import PluginInstallListener
+from base.plugin.profile_history import ProfileHistory
 from base.system.system import System
 
 
@@ -37,6 +47,22 @@ class PluginManager(object):
         self.install_listener()
         self.delayed_profiles = dict()
         self.delayed_tasks = dict()
+        self.profile_history = ProfileHistory()
+        self.modules = dict()
+        self.modules_lock = threading.Lock()
+        self.registry = PluginRegistry(self)
+        self.lazy_start = str(self.config_manager.get('PLUGIN', 'lazy_start', fallback='true')).lower() == 'true'
+        self.idle_timeout = int(self.config_manager.get('PLUGIN', 'idle_timeout', fallback='300')) or None
+        self.queue_aging = int(self.config_manager.get('PLUGIN', 'queue_aging', fallback='60')) or None
+        self.queue_size = int(self.config_manager.get('PLUGIN', 'queue_size', fallback='1000'))
+        self.queue_overflow = str(self.config_manager.get('PLUGIN', 'queue_overflow', fallback='reject')).lower()
+        self.incremental_policy = str(
+            self.config_manager.get('PLUGIN', 'incremental_policy', fallback='true')).lower() == 'true'
+        self.process_pool_size = int(self.config_manager.get('PLUGIN', 'process_pool_size', fallback='0'))
+        self.process_plugins = [name.strip() for name in
+                                self.config_manager.get('PLUGIN', 'process_plugins', fallback='').split(',')
+                                if name.strip()]
+        self.process_pool = None
 
     # TODO version?
     def load_plugins(self):
@@ -57,6 +83,46 @@ class PluginManager(object):
         except Exception as e:
             self.logger.warning('Plugin folder path not found. Error Message: {0}'.format(str(e)))
 
+        self.start_process_pool()
+
+    def start_process_pool(self):
+        isolated = [name for name in self.registry.plugins if self.is_isolated(name)]
+        if self.process_pool_size <= 0 or len(isolated) == 0 or self.process_pool is not None:
+            return
+        try:
+            self.process_pool = PluginProcessPool(self.process_pool_size, isolated)
+            self.process_pool.start()
+        except Exception as e:
+            self.process_pool = None
+            self.logger.error(
+                'Plugin process pool could not be started, plugins will run in threads. Error Message: {0}'.format(
+                    str(e)))
+
+    def stop_process_pool(self):
+        if self.process_pool is not None:
+            self.process_pool.shutdown()
+            self.process_pool = None
+
+    def is_isolated(self, plugin_name):
+        """
+            Isolated plugins are listed in configuration or declare 'process' in their info.
+        """
+        if self.process_pool_size <= 0:
+            return False
+        entry = self.registry.get(plugin_name)
+        return plugin_name in self.process_plugins or (entry is not None and entry['process'])
+
+    def run_handler(self, plugin_name, module, function_name, args, context):
+        """
+            Runs handler function of plugin module with context, in process pool if plugin is isolated. Isolated
+            handlers are interrupted in their worker process when deadline of context passes.
+        """
+        if self.process_pool is not None and self.is_isolated(plugin_name):
+            context.data = self.process_pool.run(plugin_name, module.__name__.rsplit('.', 1)[-1], function_name,
+                                                 args, context.data, context.remaining())
+        else:
+            getattr(module, function_name)(*(tuple(args) + (context,)))
+
     def load_single_plugin(self, plugin_name):
         # TODO check already loaded plugin
         location = os.path.join(self.config_manager.get("PLUGIN", "pluginFolderPath"), plugin_name)
@@ -68,34 +134,59 @@ class PluginManager(object):
             if self.is_plugin_loaded(plugin_name):
                 self.logger.debug(
                     '{0} plugin was already loaded. Reloading {0} plugin'.format(plugin_name))
+                self.invalidate_modules(plugin_name)
+                self.registry.register(plugin_name)
                 # self.reload_single_plugin(plugin_name)
             else:
-                self.plugin_queue_dict[plugin_name] = PluginQueue()
-                plugin = Plugin(plugin_name, self.plugin_queue_dict[plugin_name])
-                plugin.setDaemon(True)
-                plugin.start()
-                self.plugins.append(plugin)
-                self.logger.debug('New plugin was loaded. Plugin Name: {0}'.format(plugin_name))
-
-                # active init mode
+                entry = self.registry.register(plugin_name)
+                worker_count = int(self.config_manager.get('PLUGIN_WORKERS', plugin_name, fallback=entry['workers']))
+                main_py = self.load_module(plugin_name, self.config_manager.get("PLUGIN", "mainModuleName"))
+                dispatcher = PluginDispatcher(worker_count, functools.partial(self.create_worker, plugin_name),
+                                              getattr(main_py, 'ordering_key', None), self.release_worker,
+                                              self.queue_aging, self.queue_size,
+                                              self.queue_overflow == 'drop_oldest')
+                self.plugin_queue_dict[plugin_name] = dispatcher
+                self.logger.debug(
+                    'New plugin was loaded. Plugin Name: {0}, Workers: {1}'.format(plugin_name, worker_count))
+
+                # active init mode, lazy plugins run it before their first item
                 mode = InitMode()
-                self.plugin_queue_dict[plugin_name].put(mode, 1)
+                if self.lazy_start:
+                    dispatcher.defer(mode)
+                else:
+                    dispatcher.put(mode, 1)
 
         if plugin_name in self.delayed_profiles:
-            self.plugin_queue_dict[plugin_name].put(self.delayed_profiles[plugin_name], 1)
+            self.queue_item(plugin_name, self.delayed_profiles[plugin_name])
             del self.delayed_profiles[plugin_name]
             self.logger.debug('Delayed profile was found for this plugin. It will be run.')
         if plugin_name in self.delayed_tasks:
-            self.plugin_queue_dict[plugin_name].put(self.delayed_tasks[plugin_name], 1)
+            self.queue_item(plugin_name, self.delayed_tasks[plugin_name])
             del self.delayed_tasks[plugin_name]
             self.logger.debug('Delayed task was found for this plugin. It will be run.')
 
+    def create_worker(self, plugin_name, index, queue, context, idle_callback):
+        plugin = Plugin(plugin_name, queue, mode_handler=(index == 0), context=context, idle_timeout=self.idle_timeout,
+                        idle_callback=idle_callback)
+        plugin.setDaemon(True)
+        plugin.start()
+        self.plugins.append(plugin)
+        self.logger.debug('Worker {0} of {1} plugin was started'.format(index, plugin_name))
+        return plugin
+
+    def release_worker(self, plugin):
+        try:
+            self.plugins.remove(plugin)
+        except ValueError:
+            pass
+
     def reload_plugins(self):
         try:
             self.logger.info('Reloading plugins...')
             for p_queue in self.plugin_queue_dict:
                 self.plugin_queue_dict[p_queue].put(ShutdownMode(), 1)
             self.plugins = []
+            self.invalidate_modules()
             self.load_plugins()
             self.logger.info('Plugin reloaded successfully.')
         except Exception as e:
@@ -120,6 +211,8 @@ class PluginManager(object):
                 self.plugin_queue_dict[p_queue].put(ShutdownMode(), 1)
             self.plugins = []
             self.plugin_queue_dict = dict()
+            self.invalidate_modules()
+            self.registry.unregister()
             self.logger.debug('All plugins were removed successfully.')
         except Exception as e:
             self.logger.error(
@@ -133,9 +226,9 @@ class PluginManager(object):
                 self.plugin_queue_dict[plugin_name].put(ShutdownMode(), 1)
                 del self.plugin_queue_dict[plugin_name]
 
-                for plugin in self.plugins:
-                    if plugin.name == plugin_name:
-                        self.plugins.remove(plugin)
+                self.plugins = [plugin for plugin in self.plugins if plugin.name != plugin_name]
+                self.invalidate_modules(plugin_name)
+                self.registry.unregister(plugin_name)
                 self.logger.debug('{0} plugin was removed.'.format(plugin_name))
             else:
                 self.logger.warning('{0} plugin not found.'.format(plugin_name))
@@ -144,14 +237,63 @@ class PluginManager(object):
                 'A problem occurred while removing {0} plugin. Error Message :{1}.'.format(plugin_name,
                                                                                            str(e)))
 
+    def load_module(self, plugin_name, module_name):
+        """
+            Returns module of plugin from cache, module is loaded again only if its file was modified.
+            Modules are registered with plugin namespaced names so that same named modules of plugins do not collide.
+        """
+        if not self.is_valid_name(plugin_name) or not self.is_valid_name(module_name):
+            self.logger.warning('Invalid module name {0} of {1} plugin was refused'.format(module_name, plugin_name))
+            return None
+
+        path = os.path.join(self.config_manager.get("PLUGIN", "pluginFolderPath"), plugin_name, module_name + '.py')
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+        key = (plugin_name, module_name)
+        with self.modules_lock:
+            cached = self.modules.get(key)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+
+            full_name = 'ahenk_plugins.{0}.{1}'.format(plugin_name, module_name)
+            spec = importlib.util.spec_from_file_location(full_name, path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            sys.modules[full_name] = module
+            self.modules[key] = (mtime, module)
+            self.logger.debug('{0} module of {1} plugin was loaded'.format(module_name, plugin_name))
+            return module
+
+    def invalidate_modules(self, plugin_name=None):
+        with self.modules_lock:
+            for key in list(self.modules):
+                if plugin_name is None or key[0] == plugin_name:
+                    del self.modules[key]
+                    sys.modules.pop('ahenk_plugins.{0}.{1}'.format(key[0], key[1]), None)
+
+    @staticmethod
+    def is_valid_name(name):
+        """
+            Plugin and module names come from Lider messages, they must not point outside of plugin folder.
+        """
+        name = str(name)
+        return name != '' and not name.startswith('.') and os.path.basename(name) == name and \
+            (os.altsep is None or os.altsep not in name)
+
     def find_command(self, plugin_name, version, command_id):
-        location = os.path.join(self.config_manager.get("PLUGIN", "pluginFolderPath"), plugin_name)
-        if os.path.isdir(location) and command_id + ".py" in os.listdir(location):
-            info = imp.find_module(command_id, [location])
-            return imp.load_module(command_id, *info)
-        else:
+        # commands are the modules registered for plugin, a new command file is picked up by registering again
+        if not self.registry.has_command(plugin_name, command_id):
+            self.registry.register(plugin_name)
+        if not self.registry.has_command(plugin_name, command_id):
             self.logger.warning('Command id -' + command_id + ' - not found')
             return None
+        module = self.load_module(plugin_name, command_id)
+        if module is None:
+            self.logger.warning('Command id -' + command_id + ' - not found')
+        return module
 
     def process_task(self, task):
 
@@ -165,7 +307,7 @@ class PluginManager(object):
             plugin_ver = task.get_plugin().get_version()
 
             if self.does_plugin_exist(plugin_name, plugin_ver) and plugin_name in self.plugin_queue_dict:
-                self.plugin_queue_dict[plugin_name].put(task, 1)
+                self.queue_item(plugin_name, task)
             else:
                 self.logger.warning(
                     '{0} plugin not found. Task was delayed. Ahenk will request plugin from Lider if distribution available'.format(
@@ -176,17 +318,81 @@ class PluginManager(object):
         except Exception as e:
             self.logger.error(
                 'Exception occurred while processing task. Error Message: {0}'.format(str(e)))
+            self.reject_task(task, 'Task could not be processed. Error Message: {0}'.format(str(e)))
+
+    def queue_item(self, plugin_name, item):
+        accepted, dropped = self.plugin_queue_dict[plugin_name].put(item, 1)
+        if dropped is not None:
+            self.logger.warning(
+                'Queue of {0} plugin is full. Oldest scheduled task ({1}) was dropped. Queue metrics: {2}'.format(
+                    plugin_name, str(dropped.get_id()), str(self.queue_metrics(plugin_name))))
+            self.reject_task(dropped, 'Scheduled task was dropped because queue of {0} plugin is full'.format(
+                plugin_name))
+        if not accepted:
+            self.logger.warning(
+                'Queue of {0} plugin is full. {1} was rejected. Queue metrics: {2}'.format(
+                    plugin_name, str(item.obj_name), str(self.queue_metrics(plugin_name))))
+            if item.obj_name == 'TASK':
+                self.reject_task(item, 'Task was rejected because queue of {0} plugin is full'.format(plugin_name))
+            elif item.obj_name == 'PROFILE':
+                self.reject_profile(item,
+                                    'Profile was rejected because queue of {0} plugin is full'.format(plugin_name))
+        return accepted
+
+    def reject_task(self, task, message):
+        """
+            Reports a task which was not executed. Its result is not stored, so Lider can send it again.
+        """
+        try:
+            response = Response(type=MessageType.TASK_STATUS.value, id=task.get_id(),
+                                code=MessageCode.TASK_ERROR.value, message=message)
+            message = self.message_manager.task_status_msg(response)
+            self.scope.get_task_manager().release_task(task.get_id())
+            self.scope.get_messenger().send_direct_message(message)
+        except Exception as e:
+            self.logger.error(
+                'A problem occurred while reporting rejected task. Error Message: {0}'.format(str(e)))
+
+    def reject_profile(self, profile, message):
+        try:
+            response = Response(type=MessageType.POLICY_STATUS.value, id=profile.get_id(),
+                                code=MessageCode.POLICY_ERROR.value, message=message,
+                                execution_id=self.db_service.select_one_result('policy', 'execution_id', 'id = ?',
+                                                                               [profile.get_id()], cached=True),
+                                policy_version=self.db_service.select_one_result('policy', 'version', 'id = ?',
+                                                                                 [profile.get_id()], cached=True))
+            self.scope.get_messenger().send_direct_message(self.message_manager.policy_status_msg(response))
+        except Exception as e:
+            self.logger.error(
+                'A problem occurred while reporting rejected profile. Error Message: {0}'.format(str(e)))
+
+    def queue_metrics(self, plugin_name=None):
+        """
+            Returns depth, high-water mark and waiting times of plugin queues, summed over workers of each plugin.
+        """
+        metrics = dict()
+        for name, dispatcher in list(self.plugin_queue_dict.items()):
+            if plugin_name is not None and name != plugin_name:
+                continue
+            queues = dispatcher.metrics()
+            processed = sum(queue['processed'] for queue in queues)
+            metrics[name] = {'depth': sum(queue['depth'] for queue in queues),
+                             'high_water': sum(queue['high_water'] for queue in queues),
+                             'wait_avg': sum(queue['wait_avg'] * queue['processed'] for queue in queues) / processed
+                             if processed else 0.0,
+                             'wait_max': max(queue['wait_max'] for queue in queues),
+                             'processed': processed,
+                             'rejected': sum(queue['rejected'] for queue in queues),
+                             'dropped': sum(queue['dropped'] for queue in queues)}
+        return metrics if plugin_name is None else metrics.get(plugin_name)
 
     def find_policy_module(self, plugin_name,version=None):
-        location = os.path.join(self.config_manager.get("PLUGIN", "pluginFolderPath"), plugin_name)
-        if os.path.isdir(location) and "policy.py" in os.listdir(location):
-            info = imp.find_module("policy", [location])
-            return imp.load_module("policy", *info)
-        else:
+        module = self.load_module(plugin_name, 'policy')
+        if module is None:
             self.logger.warning('policy.py not found Plugin Name : ' + str(plugin_name))
-            return None
+        return module
 
-    def process_policy(self, policy):
+    def process_policy(self, policy, force=False):
 
         self.logger.info('Processing policies...')
         username = policy.username
@@ -216,13 +422,33 @@ class PluginManager(object):
                             user_profiles.remove(same_plugin_profile)
 
                 agent_profile.set_username(None)
-                self.process_profile(agent_profile)
+                self.process_changed_profile(agent_profile, force)
 
         if user_profiles is not None and len(user_profiles) > 0:
             self.logger.info('Working on User profiles...')
             for user_profile in user_profiles:
                 user_profile.set_username(username)
-                self.process_profile(user_profile)
+                self.process_changed_profile(user_profile, force)
+
+    def process_changed_profile(self, profile, force=False):
+        if force or not self.incremental_policy or self.profile_history.is_changed(profile):
+            self.process_profile(profile)
+            return
+
+        self.logger.debug('Profile of {0} plugin was not changed since its last successful execution. '
+                          'It was skipped.'.format(profile.get_plugin().get_name()))
+        try:
+            response = Response(type=MessageType.POLICY_STATUS.value, id=profile.get_id(),
+                                code=MessageCode.POLICY_PROCESSED.value,
+                                message='Profile was not changed since its last successful execution. It was skipped.',
+                                execution_id=self.db_service.select_one_result('policy', 'execution_id', 'id = ?',
+                                                                               [profile.get_id()], cached=True),
+                                policy_version=self.db_service.select_one_result('policy', 'version', 'id = ?',
+                                                                                 [profile.get_id()], cached=True))
+            self.scope.get_messenger().send_direct_message(self.message_manager.policy_status_msg(response))
+        except Exception as e:
+            self.logger.error(
+                'A problem occurred while reporting skipped profile. Error Message: {0}'.format(str(e)))
 
     def process_profile(self, profile):
 
@@ -231,7 +457,7 @@ class PluginManager(object):
             plugin_name = plugin.get_name()
             plugin_ver = plugin.get_version()
             if self.does_plugin_exist(plugin_name, plugin_ver) and plugin_name in self.plugin_queue_dict:
-                self.plugin_queue_dict[plugin_name].put(profile, 1)
+                self.queue_item(plugin_name, profile)
             else:
                 self.logger.warning(
                     '{0} plugin  {1} version not found. Profile was delayed. Ahenk will request plugin from Lider if distribution available'.format(
@@ -244,50 +470,57 @@ class PluginManager(object):
                 'Exception occurred while processing profile. Error Message: {0}'.format(str(e)))
 
     def does_plugin_exist(self, name, version):
-        location = os.path.join(self.config_manager.get("PLUGIN", "pluginFolderPath"), name)
-        main = self.config_manager.get("PLUGIN", "mainModuleName")
-        if os.path.isdir(location) and main + ".py" in os.listdir(location):
-            info = imp.find_module(main, [location])
-            main_py = imp.load_module(main, *info)
-            if main_py.info() is None or main_py.info()['version'] == version:
-                return True
-        return False
+        if self.registry.has_version(name, version):
+            return True
+        # plugin may be upgraded in place without a plugin directory event
+        self.registry.register(name)
+        return self.registry.has_version(name, version)
 
     def process_mode(self, mode_type, username=None):
+        """
+            Sends mode to plugins which implement it. Returns a barrier which completes when all of them finish.
+        """
+        barrier = ModeBarrier(mode_type)
         mode = None
         if mode_type == 'init':
-            mode = InitMode()
+            mode = InitMode(barrier)
         elif mode_type == 'shutdown':
-            mode = ShutdownMode()
+            mode = ShutdownMode(barrier)
         elif mode_type == 'login':
-            mode = LoginMode(username)
+            mode = LoginMode(username, barrier)
         elif mode_type == 'logout':
-            mode = LogoutMode(username)
+            mode = LogoutMode(username, barrier)
         elif mode_type == 'safe':
-            mode = SafeMode(username)
+            mode = SafeMode(username, barrier)
         else:
             self.logger.error('Unknown mode type: {0}'.format(mode_type))
 
         if mode is not None:
             self.logger.info('{0} mode is running'.format(mode_type))
-            for plugin_name in self.plugin_queue_dict:
+            for plugin_name, dispatcher in list(self.plugin_queue_dict.items()):
+                # plugins are not activated for modes they do not implement
+                if mode_type != 'shutdown' and not self.registry.has_mode(plugin_name, mode_type):
+                    continue
+                # plugins which were never activated have nothing to shut down
+                if mode_type == 'shutdown' and not dispatcher.activated:
+                    continue
                 try:
-                    self.plugin_queue_dict[plugin_name].put(mode, 1)
+                    barrier.add(plugin_name)
+                    dispatcher.put(mode, 1)
                 except Exception as e:
+                    barrier.discard(plugin_name)
                     self.logger.error(
                         'Exception occurred while switching safe mode. Error Message : {0}'.format(
                             str(e)))
+        barrier.seal()
+        return barrier
 
     def find_module(self, mode, plugin_name):
         mode = mode.lower().replace('_mode', '')
-        location = os.path.join(self.config_manager.get("PLUGIN", "pluginFolderPath"), plugin_name)
-
-        if os.path.isdir(location) and (mode + ".py") in os.listdir(location):
-            info = imp.find_module(mode, [location])
-            return imp.load_module(mode, *info)
-        else:
+        module = self.load_module(plugin_name, mode)
+        if module is None:
             self.logger.warning('{0} not found in {1} plugin'.format((mode + '.py'), plugin_name))
-            return None
+        return module
 
     def install_listener(self):
         listener = PluginInstallListener(System.Ahenk.plugins_path())
@@ -309,3 +542,5 @@ class PluginManager(object):
 
     def printQueueSize(self):
         print("size " + str(len(self.plugin_queue_dict)))
+        for plugin_name, metrics in self.queue_metrics().items():
+            print('{0} {1}'.format(plugin_name, str(metrics)))
@@ -0,0 +1,142 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import configparser
+import importlib.util
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from base.logger.ahenk_logger import Logger
+from base.scope import Scope
+
+# modules of isolated plugins loaded in a worker process, keyed by plugin and module name
+modules = dict()
+
+
+def initialize(config_data, plugin_folder, plugin_names):
+    """
+        Runs in each worker process. Workers are forked from a single threaded fork server, not from the daemon, so
+        they build their own scope with configuration and logger, then import all modules of isolated plugins.
+        Other services of daemon are not available to isolated plugins.
+    """
+    scope = Scope()
+    Scope.set_instance(scope)
+    config = configparser.ConfigParser()
+    config.read_dict(config_data)
+    scope.set_configuration_manager(config)
+    scope.set_logger(Logger())
+
+    for plugin_name in plugin_names:
+        try:
+            for file_name in os.listdir(os.path.join(plugin_folder, plugin_name)):
+                if file_name.endswith('.py'):
+                    load_module(plugin_folder, plugin_name, file_name[:-3])
+        except Exception as e:
+            scope.get_logger().warning(
+                'Modules of {0} plugin could not be preloaded. Error Message: {1}'.format(plugin_name, str(e)))
+
+
+def load_module(plugin_folder, plugin_name, module_name):
+    """
+        Loads module of plugin in worker process with the same namespaced name PluginManager uses in daemon.
+        Module names are validated by daemon before an item is sent.
+    """
+    path = os.path.join(plugin_folder, plugin_name, module_name + '.py')
+    mtime = os.stat(path).st_mtime_ns
+    cached = modules.get((plugin_name, module_name))
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    full_name = 'ahenk_plugins.{0}.{1}'.format(plugin_name, module_name)
+    spec = importlib.util.spec_from_file_location(full_name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    sys.modules[full_name] = module
+    modules[(plugin_name, module_name)] = (mtime, module)
+    return module
+
+
+def interrupt(signum, frame):
+    raise TimeoutError('Plugin handler timed out')
+
+
+def run_handler(plugin_folder, plugin_name, module_name, function_name, args, context_data, timeout=None):
+    """
+        Runs a plugin handler in worker process and returns data of its context. Handler is interrupted by an alarm
+        after timeout, so the worker process is free for next items.
+    """
+    from base.plugin.plugin import Context
+
+    context = Context()
+    context.data = context_data
+    context.start(timeout)
+    module = load_module(plugin_folder, plugin_name, module_name)
+    if timeout:
+        signal.signal(signal.SIGALRM, interrupt)
+        signal.setitimer(signal.ITIMER_REAL, max(timeout, 0.01))
+    try:
+        getattr(module, function_name)(*(tuple(args) + (context,)))
+    finally:
+        if timeout:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    return context.data
+
+
+class PluginProcessPool(object):
+    """
+        Pool of worker processes which run handlers of isolated plugins.
+        Daemon runs many threads, forking it directly could leave locks held by other threads locked in workers.
+        Workers are forked from a fork server instead, which is started once with base modules preloaded, so a
+        crashed worker can be replaced safely at any time. Only context data of an item is sent to a worker and
+        returned back. A crashed worker breaks the pool, the pool is created again for the next items.
+    """
+
+    def __init__(self, size, plugin_names):
+        scope = Scope.get_instance()
+        self.logger = scope.get_logger()
+        self.config_manager = scope.get_configuration_manager()
+        self.size = size
+        self.plugin_names = list(plugin_names)
+        self.plugin_folder = self.config_manager.get('PLUGIN', 'pluginFolderPath')
+        self.lock = threading.Lock()
+        self.executor = None
+        self.mp_context = multiprocessing.get_context('forkserver')
+        self.mp_context.set_forkserver_preload(['base.plugin.plugin_process_pool', 'base.plugin.plugin'])
+
+    def config_data(self):
+        return dict((section, dict(self.config_manager.items(section, raw=True)))
+                    for section in self.config_manager.sections())
+
+    def start(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.size, mp_context=self.mp_context,
+                                                    initializer=initialize,
+                                                    initargs=(self.config_data(), self.plugin_folder,
+                                                              self.plugin_names))
+                self.logger.info('Plugin process pool was started with {0} workers'.format(self.size))
+            return self.executor
+
+    def run(self, plugin_name, module_name, function_name, args, context_data, timeout=None):
+        executor = self.start()
+        try:
+            return executor.submit(run_handler, self.plugin_folder, plugin_name, module_name, function_name, args,
+                                   context_data, timeout).result()
+        except BrokenProcessPool:
+            self.logger.error('A plugin worker process terminated abruptly, plugin process pool is restarting')
+            with self.lock:
+                if self.executor is executor:
+                    self.executor = None
+            executor.shutdown(wait=False)
+            raise
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False)
+                self.executor = None
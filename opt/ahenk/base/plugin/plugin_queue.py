@@ -2,10 +2,106 @@
 # -*- coding: utf-8 -*-
 # Author: İsmail BAŞARAN <ismail.basaran@tubitak.gov.tr> <basaran.ismaill@gmail.com>
 
+import time
+from collections import deque
 from queue import Queue
 
 
 class PluginQueue(Queue):
+    """
+        Stable priority queue of plugin items. Modes are processed first, then interactive tasks, scheduled tasks and
+        profiles. Items of same priority keep their order. An item gains one priority level for every aging seconds
+        it waits, so low priority items are not starved by a continuous flow of higher priority ones.
+        Queue keeps its depth, high-water mark and waiting times of items as metrics.
+    """
+
+    MODE = 0
+    TASK = 1
+    SCHEDULED_TASK = 2
+    PROFILE = 3
+    PRIORITIES = (MODE, TASK, SCHEDULED_TASK, PROFILE)
+
+    def __init__(self, maxsize=0, aging=None):
+        self.aging = aging
+        self.high_water = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.wait_count = 0
+        self.rejected = 0
+        self.dropped = 0
+        super(PluginQueue, self).__init__(maxsize)
+
+    @staticmethod
+    def priority(item):
+        obj_name = item.obj_name
+        if 'MODE' in obj_name:
+            return PluginQueue.MODE
+        if obj_name == 'TASK':
+            return PluginQueue.SCHEDULED_TASK if item.get_cron_str() else PluginQueue.TASK
+        return PluginQueue.PROFILE
+
+    def _init(self, maxsize):
+        self.queue = dict((priority, deque()) for priority in self.PRIORITIES)
+
+    def _qsize(self):
+        return sum(len(items) for items in self.queue.values())
+
+    def _put(self, item):
+        self.queue[self.priority(item)].append((time.monotonic(), item))
+        self.high_water = max(self.high_water, self._qsize())
+
+    def _get(self):
+        now = time.monotonic()
+        selected = None
+        selected_rank = None
+        for priority in self.PRIORITIES:
+            items = self.queue[priority]
+            if not items:
+                continue
+            rank = priority
+            if self.aging:
+                rank -= (now - items[0][0]) / self.aging
+            if selected is None or rank < selected_rank:
+                selected = items
+                selected_rank = rank
+        put_time, item = selected.popleft()
+        wait = now - put_time
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+        self.wait_count += 1
+        return item
+
+    def offer(self, item, drop_oldest=False):
+        """
+            Puts item without blocking. If queue is full, oldest scheduled task is dropped for the item when
+            drop_oldest is set, otherwise item is rejected. Modes are always accepted.
+            Returns a tuple of accepted flag and dropped item.
+        """
+        with self.not_full:
+            dropped = None
+            if 0 < self.maxsize <= self._qsize() and self.priority(item) != self.MODE:
+                if not drop_oldest or not self.queue[self.SCHEDULED_TASK]:
+                    self.rejected += 1
+                    return False, None
+                dropped = self.queue[self.SCHEDULED_TASK].popleft()[1]
+                self.unfinished_tasks -= 1
+                self.dropped += 1
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+            return True, dropped
+
+    def metrics(self):
+        with self.mutex:
+            return {'depth': self._qsize(),
+                    'max_size': self.maxsize,
+                    'high_water': self.high_water,
+                    'wait_avg': self.wait_total / self.wait_count if self.wait_count else 0.0,
+                    'wait_max': self.wait_max,
+                    'processed': self.wait_count,
+                    'rejected': self.rejected,
+                    'dropped': self.dropped}
+
     def __contains__(self, item):
         with self.mutex:
-            return item in self.queue
+            return any(item is current or item == current for items in self.queue.values() for _, current in items)
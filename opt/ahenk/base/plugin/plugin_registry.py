@@ -0,0 +1,79 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+
+from base.scope import Scope
+
+
+class PluginRegistry(object):
+    """
+        In memory index of installed plugins with their versions, commands and modes.
+        Entries are refreshed when a plugin is loaded and dropped when it is removed.
+    """
+
+    MODES = ('init', 'login', 'logout', 'safe', 'shutdown')
+
+    def __init__(self, plugin_manager):
+        scope = Scope.get_instance()
+        self.logger = scope.get_logger()
+        self.config_manager = scope.get_configuration_manager()
+        self.plugin_manager = plugin_manager
+        self.lock = threading.Lock()
+        self.plugins = dict()
+
+    def register(self, plugin_name):
+        if not self.plugin_manager.is_valid_name(plugin_name):
+            return None
+        location = os.path.join(self.config_manager.get("PLUGIN", "pluginFolderPath"), plugin_name)
+        main = self.config_manager.get("PLUGIN", "mainModuleName")
+        try:
+            module_names = [file_name[:-3] for file_name in os.listdir(location) if file_name.endswith('.py')]
+        except OSError:
+            module_names = []
+
+        if main not in module_names:
+            self.unregister(plugin_name)
+            return None
+
+        info = self.plugin_manager.load_module(plugin_name, main).info()
+        entry = {
+            'name': plugin_name,
+            'version': info['version'] if info is not None else None,
+            'workers': int(info.get('workers', 1)) if info is not None else 1,
+            'process': bool(info.get('process', False)) if info is not None else False,
+            'policy': 'policy' in module_names,
+            'modes': set(name for name in module_names if name in self.MODES),
+            'commands': set(name for name in module_names if name not in self.MODES + (main, 'policy'))
+        }
+        with self.lock:
+            self.plugins[plugin_name] = entry
+        self.logger.debug('{0} plugin was registered. Version: {1}'.format(plugin_name, entry['version']))
+        return entry
+
+    def unregister(self, plugin_name=None):
+        with self.lock:
+            if plugin_name is None:
+                self.plugins = dict()
+            else:
+                self.plugins.pop(plugin_name, None)
+
+    def get(self, plugin_name):
+        with self.lock:
+            return self.plugins.get(plugin_name)
+
+    def has_version(self, plugin_name, version):
+        """
+            Plugins without version info match any version.
+        """
+        entry = self.get(plugin_name)
+        return entry is not None and (entry['version'] is None or entry['version'] == version)
+
+    def has_command(self, plugin_name, command_id):
+        entry = self.get(plugin_name)
+        return entry is not None and command_id in entry['commands']
+
+    def has_mode(self, plugin_name, mode):
+        entry = self.get(plugin_name)
+        return entry is not None and mode in entry['modes']
@@ -0,0 +1,52 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import hashlib
+
+from base.model.enum.message_code import MessageCode
+from base.scope import Scope
+
+
+class ProfileHistory(object):
+    """
+        Keeps content hash and result code of the last applied profile for each user and plugin.
+        Agent profiles are kept with empty username.
+    """
+
+    def __init__(self):
+        scope = Scope.get_instance()
+        self.logger = scope.get_logger()
+        self.db_service = scope.get_db_service()
+        self.cols = ['username', 'plugin', 'profile_hash', 'response_code']
+
+    @staticmethod
+    def profile_hash(profile):
+        plugin = profile.get_plugin()
+        content = '{0}:{1}:{2}'.format(plugin.get_name(), plugin.get_version(), profile.get_profile_data())
+        return hashlib.md5(content.encode('utf-8')).hexdigest()
+
+    def is_changed(self, profile):
+        """
+            Returns False only if the same profile content was applied successfully before.
+        """
+        try:
+            rows = self.db_service.select('profile_result', ['profile_hash', 'response_code'],
+                                          'username = ? and plugin = ?',
+                                          criteria_args=[profile.get_username() or '',
+                                                         profile.get_plugin().get_name()], cached=True)
+            if len(rows) > 0 and rows[0][0] == self.profile_hash(profile) \
+                    and rows[0][1] == MessageCode.POLICY_PROCESSED.value:
+                return False
+        except Exception as e:
+            self.logger.error(
+                'A problem occurred while checking profile history. Error Message: {0}'.format(str(e)))
+        return True
+
+    def save(self, profile, response_code):
+        try:
+            self.db_service.submit(['profile_result'], self.db_service.upsert, 'profile_result', self.cols,
+                                   [profile.get_username() or '', profile.get_plugin().get_name(),
+                                    self.profile_hash(profile), str(response_code)], ['username', 'plugin'])
+        except Exception as e:
+            self.logger.error(
+                'A problem occurred while saving profile history. Error Message: {0}'.format(str(e)))
@@ -44,7 +44,7 @@ class Registration:
 
     def registration_process(self, reg_reply):
         self.logger.debug('Reading registration reply')
-        j = json.loads(reg_reply)
+        j = reg_reply
         self.logger.debug('[Registration]' + j['message'])
         status = str(j['status']).lower()
         dn = str(j['agentDn'])
@@ -62,13 +62,13 @@ class Registration:
 
     def update_registration_attrs(self, dn=None):
         self.logger.debug('Registration configuration is updating...')
-        self.db_service.update('registration', ['dn', 'registered'], [dn, 1], ' registered = 0')
+        self.db_service.update('registration', ['dn', 'registered'], [dn, 1], 'registered = ?', [0])
 
         if self.conf_manager.has_section('CONNECTION'):
             self.conf_manager.set('CONNECTION', 'uid',
-                                  self.db_service.select_one_result('registration', 'jid', ' registered=1'))
+                                  self.db_service.select_one_result('registration', 'jid', 'registered = ?', [1]))
             self.conf_manager.set('CONNECTION', 'password',
-                                  self.db_service.select_one_result('registration', 'password', ' registered=1'))
+                                  self.db_service.select_one_result('registration', 'password', 'registered = ?', [1]))
             # TODO  get file path?
             with open('/etc/ahenk/ahenk.conf', 'w') as configfile:
                 self.conf_manager.write(configfile)
@@ -85,7 +85,7 @@ class Registration:
             return False
 
     def is_ldap_registered(self):
-        dn = self.db_service.select_one_result('registration', 'dn', 'registered = 1')
+        dn = self.db_service.select_one_result('registration', 'dn', 'registered = ?', [1])
         if dn is not None and dn != '':
             return True
         else:
@@ -97,8 +97,9 @@ class Registration:
         vals = [str(self.generate_uuid(uuid_depend_mac)), str(self.generate_password()), 0,
                 str(self.get_registration_params()), str(datetime.datetime.now().strftime("%d-%m-%Y %I:%M"))]
 
-        self.db_service.delete('registration', ' 1==1 ')
-        self.db_service.update('registration', cols, vals)
+        with self.db_service.transaction():
+            self.db_service.delete('registration')
+            self.db_service.update('registration', cols, vals)
         self.logger.debug('Registration parameters were created')
 
     def get_registration_params(self):
@@ -147,7 +148,7 @@ class Registration:
 
     def unregister(self):
         self.logger.debug('Ahenk is unregistering...')
-        self.db_service.delete('registration', ' 1==1 ')
+        self.db_service.delete('registration')
         self.logger.debug('Ahenk is unregistered')
 
     def re_register(self):
@@ -41,7 +41,7 @@ class CustomScheduler(BaseScheduler):
     # unused
     def remove_job(self, task_id):
         for event in self.events:
-            if event.task.get_id() == task_id:
+            if isinstance(event, ScheduleTaskJob) and event.task.get_id() == task_id:
                 self.scheduledb.delete(task_id)
                 self.logger.debug('Task was deleted from scheduled tasks table')
                 self.events.remove(event)
@@ -50,7 +50,7 @@ class CustomScheduler(BaseScheduler):
     # unused
     def remove_job_via_task_id(self, task_id):
         for event in self.events:
-            if event.task.get_id() == task_id:
+            if isinstance(event, ScheduleTaskJob) and event.task.get_id() == task_id:
                 self.scheduledb.delete(event.task)
                 self.events.remove(event)
 
@@ -23,13 +23,13 @@ class ScheduleTaskDB(object):
         cols = ['task_id']
         values = [task.get_id()]
         self.logger.debug('Saving scheduler task to db... ')
-        self.db_service.update('schedule_task', cols, values, None)
+        self.db_service.update_async('schedule_task', cols, values)
         self.logger.debug('Scheduler task saved.')
 
     def delete(self, task_id):
         try:
             self.logger.debug('Deleting schedule task. Task id=' + str(task_id))
-            self.db_service.delete('schedule_task', 'task_id=' + str(task_id))
+            self.db_service.delete_async('schedule_task', 'task_id = ?', [str(task_id)])
             self.logger.debug('Deleting schedule task deleted successfully. task id=' + str(task_id))
         except Exception as e:
             self.logger.error('Exception occur when deleting schedule task ' + str(e))
@@ -112,7 +112,7 @@ class System:
         def dn():
             system = System()
             try:
-                dn = system.db_service.select_one_result('registration', 'dn', " registered='1'")
+                dn = system.db_service.select_one_result('registration', 'dn', 'registered = ?', [1])
                 return dn
             except:
                 return None
@@ -271,13 +271,13 @@ class System:
         @staticmethod
         def display(username):
             system = System()
-            display = system.db_service.select_one_result('session', 'display', " username='{0}'".format(username))
+            display = system.db_service.select_one_result('session', 'display', 'username = ?', [username], cached=True)
             return display
 
         @staticmethod
         def desktop(username):
             system = System()
-            desktop = system.db_service.select_one_result('session', 'desktop', " username='{0}'".format(username))
+            desktop = system.db_service.select_one_result('session', 'desktop', 'username = ?', [username], cached=True)
             return desktop
 
         @staticmethod
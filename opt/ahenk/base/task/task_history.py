@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import threading
+from collections import OrderedDict
+
+from base.scope import Scope
+
+
+class TaskHistory(object):
+    """
+        Remembers received task ids to detect tasks re-sent by Lider.
+        Recent ids are kept in a bounded LRU, older ones are looked up from task table together with their stored
+        status message. A task in the LRU without result is still being executed.
+    """
+
+    def __init__(self, max_size=1024):
+        scope = Scope.get_instance()
+        self.logger = scope.get_logger()
+        self.db_service = scope.get_db_service()
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.tasks = OrderedDict()
+
+    def receive(self, task_id):
+        """
+            Marks task as received. Returns whether it was received before and its stored result message if any.
+        """
+        task_id = str(task_id)
+        with self.lock:
+            if task_id in self.tasks:
+                self.tasks.move_to_end(task_id)
+                return True, self.tasks[task_id]
+
+        result = None
+        try:
+            result = self.db_service.select_one_result('task', 'result', 'id = ? and result is not null', [task_id])
+        except Exception as e:
+            self.logger.error('A problem occurred while reading task result. Error Message: {0}'.format(str(e)))
+
+        with self.lock:
+            if task_id in self.tasks:
+                return True, self.tasks[task_id]
+            self.put(task_id, result)
+        # tasks without stored result were interrupted, they can run again
+        return result is not None, result
+
+    def save_result(self, task_id, message):
+        task_id = str(task_id)
+        with self.lock:
+            self.put(task_id, message)
+        try:
+            self.db_service.update_async('task', ['result'], [message], 'id = ?', [task_id])
+        except Exception as e:
+            self.logger.error('A problem occurred while saving task result. Error Message: {0}'.format(str(e)))
+
+    def forget(self, task_id):
+        """
+            Removes a task which was not executed, so it runs when it is received again.
+        """
+        with self.lock:
+            self.tasks.pop(str(task_id), None)
+
+    def put(self, task_id, result):
+        self.tasks[task_id] = result
+        self.tasks.move_to_end(task_id)
+        while len(self.tasks) > self.max_size:
+            self.tasks.popitem(last=False)
@@ -5,6 +5,7 @@
 from base.scope import Scope
 from base.model.message_factory import MessageFactory
 from base.model.enum.message_type import MessageType
+from base.task.task_history import TaskHistory
 
 
 class TaskManager(object):
@@ -17,6 +18,7 @@ class TaskManager(object):
         self.logger = scope.get_logger()
         self.db_service = scope.get_db_service()
         self.scheduler = scope.get_scheduler()
+        self.task_history = TaskHistory()
 
     def addTask(self, task):
         try:
@@ -29,33 +31,54 @@ class TaskManager(object):
 
         except Exception as e:
             self.logger.debug('Exception occurred when adding task. Error Message: {0}'.format(str(e)))
+            self.pluginManager.reject_task(task, 'Task could not be added. Error Message: {0}'.format(str(e)))
 
-    def addPolicy(self, policy):
+    def addPolicy(self, policy, force=False):
         try:
-            self.pluginManager.process_policy(policy)
+            self.pluginManager.process_policy(policy, force)
         except Exception as e:
             self.logger.error("Exception occurred when adding policy. Error Message: {0}".format(str(e)))
 
     def saveTask(self, task):
         try:
             self.logger.debug('task save')
-            task_cols = ['id', 'create_date', 'modify_date', 'task_code', 'parameter_map', 'deleted', 'plugin',
-                         'cron_expr', 'file_server']
-            plu_cols = ['active', 'create_date', 'deleted', 'description', 'machine_oriented', 'modify_date', 'name',
-                        'policy_plugin', 'user_oriented', 'version', 'task_plugin', 'x_based']
-            plugin_args = [str(task.get_plugin().get_active()), str(task.get_plugin().get_create_date()),
-                           str(task.get_plugin().get_deleted()), str(task.get_plugin().get_description()),
-                           str(task.get_plugin().get_machine_oriented()), str(task.get_plugin().get_modify_date()),
-                           str(task.get_plugin().get_name()), str(task.get_plugin().get_policy_plugin()),
-                           str(task.get_plugin().get_user_oriented()), str(task.get_plugin().get_version()),
-                           str(task.get_plugin().get_task_plugin()), str(task.get_plugin().get_x_based())]
-            plugin_id = self.db_service.update('plugin', plu_cols, plugin_args)
+            self.db_service.submit(['plugin', 'task'], self.insert_task, task)
+        except Exception as e:
+            self.logger.error("Exception occurred while saving task. Error Message: {0}".format(str(e)))
+
+    def insert_task(self, task):
+        task_cols = ['id', 'create_date', 'modify_date', 'task_code', 'parameter_map', 'deleted', 'plugin',
+                     'cron_expr', 'file_server']
+        plu_cols = ['active', 'create_date', 'deleted', 'description', 'machine_oriented', 'modify_date', 'name',
+                    'policy_plugin', 'user_oriented', 'version', 'task_plugin', 'x_based']
+        plugin_args = [str(task.get_plugin().get_active()), str(task.get_plugin().get_create_date()),
+                       str(task.get_plugin().get_deleted()), str(task.get_plugin().get_description()),
+                       str(task.get_plugin().get_machine_oriented()), str(task.get_plugin().get_modify_date()),
+                       str(task.get_plugin().get_name()), str(task.get_plugin().get_policy_plugin()),
+                       str(task.get_plugin().get_user_oriented()), str(task.get_plugin().get_version()),
+                       str(task.get_plugin().get_task_plugin()), str(task.get_plugin().get_x_based())]
+        with self.db_service.transaction():
+            plugin_id = self.db_service.upsert('plugin', plu_cols, plugin_args, ['name', 'version'])
             values = [str(task.get_id()), str(task.get_create_date()), str(task.get_modify_date()),
                       str(task.get_task_code()), str(task.get_parameter_map()), str(task.get_deleted()),
                       str(plugin_id), str(task.get_cron_str()), str(task.get_file_server())]
             self.db_service.update('task', task_cols, values)
-        except Exception as e:
-            self.logger.error("Exception occurred while saving task. Error Message: {0}".format(str(e)))
+
+    def receive_task(self, task):
+        """
+            Returns stored result of task if it was executed before, False if it is still being executed and None for a
+            new task.
+        """
+        received, result = self.task_history.receive(task.get_id())
+        if not received:
+            return None
+        return result if result is not None else False
+
+    def save_task_result(self, task_id, message):
+        self.task_history.save_result(task_id, message)
+
+    def release_task(self, task_id):
+        self.task_history.forget(task_id)
 
     def updateTask(self, task):
         # TODO not implemented yet
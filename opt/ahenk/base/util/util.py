@@ -9,8 +9,11 @@ import json
 import os
 import pwd
 import shutil
+import signal
 import stat
 import subprocess
+import tempfile
+import threading
 import uuid
 
 
@@ -151,6 +154,57 @@ class Util:
         except Exception as e:
             return 1, 'Could not execute command: {0}. Error Message: {1}'.format(command, str(e)), ''
 
+    @staticmethod
+    def execute_to_file(command, file_path, stdin=None, env=None, cwd=None, shell=True, as_user=None,
+                        chunk_size=65536, timeout=None):
+        """
+            Streams stdout of command into file while computing its md5, memory usage does not depend on output size.
+            Command runs in its own process group, the whole group is killed when timeout (seconds) expires.
+            Timeout of 0 or None disables it.
+            Returns result code, md5 of output and stderr.
+        """
+        try:
+            if as_user is not None:
+                command = 'su - {0} -c "{1}"'.format(as_user, command)
+            hash_md5 = hashlib.md5()
+            # stderr is spooled to a temporary file so that a full pipe can not block the command
+            with tempfile.TemporaryFile() as err, open(file_path, 'wb') as out:
+                process = subprocess.Popen(command, stdin=stdin, env=env, cwd=cwd, stderr=err,
+                                           stdout=subprocess.PIPE, shell=shell, start_new_session=True)
+                timed_out = threading.Event()
+                timer = None
+                if timeout:
+                    timer = threading.Timer(timeout, Util.kill_process_group, [process, timed_out])
+                    timer.setDaemon(True)
+                    timer.start()
+                try:
+                    for chunk in iter(lambda: process.stdout.read(chunk_size), b''):
+                        hash_md5.update(chunk)
+                        out.write(chunk)
+                    process.stdout.close()
+                    result_code = process.wait()
+                finally:
+                    if timer is not None:
+                        timer.cancel()
+                err.seek(0)
+                p_err = err.read().decode('unicode_escape')
+
+            if timed_out.is_set():
+                return result_code, None, 'Command was killed after {0} seconds timeout. {1}'.format(timeout, p_err)
+
+            return result_code, str(hash_md5.hexdigest()), p_err
+        except Exception as e:
+            return 1, None, 'Could not execute command: {0}. Error Message: {1}'.format(command, str(e))
+
+    @staticmethod
+    def kill_process_group(process, killed=None):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+            if killed is not None:
+                killed.set()
+        except ProcessLookupError:
+            pass
+
     @staticmethod
     def execute_script(script_path, parameters=None):
         command = []